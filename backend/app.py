@@ -1,17 +1,21 @@
-from flask import Flask, request, jsonify
-from backend.utils.rag_pipeline import RAGPipeline
+from flask import Flask, Response, request, jsonify, stream_with_context
+from backend.utils.rag_pipeline import RAGPipeline, new_version_dir
 from backend.utils.personalize import PreferenceStore
+from backend.utils.jobs import JobRegistry
+from backend.utils.ollama import get_client
+from backend.utils.scoring import score_pool
+from backend.utils.geo import decode_polyline, haversine_many_km
 from backend.db import enable_db, SessionLocal
 from backend.repository import (
     get_places as repo_get_places,
+    get_places_after as repo_get_places_after,
+    count_places as repo_count_places,
     search_places as repo_search_places,
     recommend_places as repo_recommend_places,
 )
-import os, math, time
-try:
-    import requests  # optional for local LLM via Ollama
-except Exception:
-    requests = None
+import json
+import os
+import shutil
 import subprocess
 
 app = Flask(__name__)
@@ -22,10 +26,21 @@ rag = RAGPipeline(
     index_dir=os.path.join(os.path.dirname(__file__), 'data', 'faiss_index')
 )
 prefs = PreferenceStore()
+# job status lives on disk so every worker process can report it
+jobs = JobRegistry(state_dir=os.getenv('JOBS_DIR') or os.path.join(rag.index_root, 'jobs'))
 
 @app.get('/health')
 def health():
-    return {'status': 'ok'}
+    client = get_client()
+    llm = client.health() if client is not None else None
+    status = 'degraded' if llm and llm['breaker']['state'] == 'open' else 'ok'
+    return {'status': status, 'llm': llm}
+
+@app.get('/stats')
+def stats():
+    out = rag.stats()
+    out['prefs'] = prefs.stats()
+    return jsonify(out)
 
 @app.post('/search')
 @app.post('/search.php')
@@ -77,12 +92,23 @@ def places():
     category = request.args.get('type') or request.args.get('category')
     subcategory = request.args.get('subcategory')
     page = int(request.args.get('page') or 1)
-    page_size = int(request.args.get('page_size') or 20)
+    page_size = max(1, int(request.args.get('page_size') or 20))
 
     if enable_db:
+        cursor = request.args.get('cursor')
         with SessionLocal() as db:
-            items = repo_get_places(db, category, subcategory, page, page_size)
-        return jsonify({'results': items, 'page': page, 'page_size': page_size, 'total': total})
+            if cursor is None:
+                items, total = repo_get_places(db, category, subcategory, page, page_size)
+                return jsonify({'results': items, 'page': page, 'page_size': page_size, 'total': total})
+            # keyset mode: pass cursor= (empty) for the first page, then next_cursor
+            try:
+                items, next_cursor = repo_get_places_after(db, category, subcategory, page_size, cursor or None)
+            except ValueError:
+                return jsonify({'results': [], 'error': 'invalid cursor'}), 400
+            out = {'results': items, 'page_size': page_size, 'next_cursor': next_cursor}
+            if request.args.get('include_total') in ('1', 'true'):
+                out['total'] = repo_count_places(db, category, subcategory, exact=False)
+        return jsonify(out)
 
     # JSON/FAISS fallback (no true pagination)
     results = rag.search('', k=100, city=city, typ=category)
@@ -121,18 +147,19 @@ def chat():
 
     # Step 2: lightweight personalization/context scoring for chat
     user_pref = prefs.get(user_id)
+    sc = score_pool(rag.tag_features, items, user_pref, tm=hour, intent=intent)
+    totals = 0.9*sc['personal'] + 0.5*sc['intent'] + 0.3*sc['context']
     scored = []
-    for it in items:
-        psc = _personalization_score(it, user_pref)
-        csc = _context_score(it, None, hour, None)
-        isc = _intent_score(it, intent)
-        total = 0.9*psc + 0.5*isc + 0.3*csc
+    for it, total in zip(items, totals.tolist()):
         it2 = dict(it)
         it2['score'] = round(total, 3)
         scored.append(it2)
     scored.sort(key=lambda x: x.get('score', 0), reverse=True)
     top = scored[:4]
 
+    if data.get('stream') or 'text/event-stream' in (request.headers.get('Accept') or ''):
+        return _chat_stream(user_msg, user_id, top, user_pref, hour, language)
+
     # Step 3: generate conversational answer via LLM (Ollama) with graceful fallback
     try:
         answer = rag.generate_conversational_answer(user_msg, top, user_pref, hour=hour, language=language)
@@ -154,6 +181,32 @@ def chat():
         'suggestions': top,
     })
 
+def _sse(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def _chat_stream(user_msg, user_id, top, user_pref, hour, language):
+    """Server-sent events: `context` (the places), one `token` per LLM fragment, then `done`."""
+    def events():
+        yield _sse('context', {'context': top, 'suggestions': top})
+        parts = []
+        try:
+            for frag in rag.stream_conversational_answer(user_msg, top, user_pref, hour=hour, language=language):
+                parts.append(frag)
+                yield _sse('token', {'token': frag})
+        except Exception:
+            if not parts:
+                parts.append(rag.generate_answer(user_msg, top))
+                yield _sse('token', {'token': parts[-1]})
+        answer = ''.join(parts).strip()
+        try:
+            prefs.update_from_interaction(user_id, user_msg, answer)
+        except Exception:
+            pass
+        yield _sse('done', {'answer': answer, 'response': answer})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
 @app.post('/prefs/update')
 def prefs_update():
     data = request.get_json(silent=True) or {}
@@ -163,118 +216,52 @@ def prefs_update():
 
 @app.post('/reindex')
 def reindex():
-    """Rebuild FAISS index from current data if dependencies are available.
-    Safe no-op if faiss is not installed. Returns ok=true regardless, with a message.
+    """Start a background rebuild of the FAISS index and return its job id.
+
+    The index is built into a new versioned directory and hot-swapped into
+    the running pipeline when done; poll /reindex/<job_id> for status.
+    Other worker processes pick the new version up from CURRENT.
+    Fails softly (status=failed, with a message) if faiss is not installed.
     """
-    try:
-        # Run build_index as a module to avoid path issues
-        root = os.path.dirname(__file__)
-        script = os.path.join(root, 'utils', 'build_index.py')
-        subprocess.check_call(['python', script])
-        msg = 'Index rebuilt.'
-    except Exception as e:
-        msg = f'Reindex skipped: {e.__class__.__name__}'
-    return jsonify({'ok': True, 'message': msg})
-
-def _deg2rad(d):
-    return d * math.pi / 180.0
-
-def _equirect_xy(lat, lng, lat0):
-    x = _deg2rad(lng) * math.cos(_deg2rad(lat0))
-    y = _deg2rad(lat)
-    return x, y
-
-def _point_segment_distance_km(a_lat, a_lng, b_lat, b_lng, p_lat, p_lng):
-    lat0 = (a_lat + b_lat) / 2.0
-    ax, ay = _equirect_xy(a_lat, a_lng, lat0)
-    bx, by = _equirect_xy(b_lat, b_lng, lat0)
-    px, py = _equirect_xy(p_lat, p_lng, lat0)
-    vx, vy = bx - ax, by - ay
-    wx, wy = px - ax, py - ay
-    c1 = vx * wx + vy * wy
-    c2 = vx * vx + vy * vy
-    t = 0.0 if c2 == 0 else max(0.0, min(1.0, c1 / c2))
-    sx, sy = ax + t * vx, ay + t * vy
-    dx, dy = px - sx, py - sy
-    r = 6371.0
-    return math.hypot(dx, dy) * r
-
-def _haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    dlat = _deg2rad(lat2 - lat1)
-    dlon = _deg2rad(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(_deg2rad(lat1)) * math.cos(_deg2rad(lat2)) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-def _personalization_score(it, user_pref):
-    s = 0.0
-    ints = [str(x).lower() for x in (user_pref.get('interests') or [])]
-    tags = [str(x).lower() for x in (it.get('tags') or [])]
-    for t in ints:
-        if t in ' '.join(tags):
-            s += 1.0
-    tp = str(user_pref.get('time_preference') or '').lower()
-    if tp:
-        s += 0.2
-    mood = str(user_pref.get('mood') or '').lower()
-    if mood:
-        s += 0.2
-    # companion boosts
-    comp = str((user_pref.get('companion') or '')).lower()
-    if comp in ('family','kids') and any(x in tags for x in ['family','kids','educational']):
-        s += 0.5
-    if comp in ('couple','friends') and any(x in tags for x in ['romantic','nightlife','cafe']):
-        s += 0.4
-    # dietary
-    dietary = user_pref.get('dietary') or {}
-    veg_only = bool(dietary.get('veg_only'))
-    if veg_only and 'non-veg' in ' '.join(tags):
-        s -= 0.6
-    if bool(dietary.get('street_food_ok')) and 'street-food' in ' '.join(tags):
-        s += 0.3
-    return s
-
-def _context_score(it, weather, tm, temp_c):
-    sc = 0.0
-    tags = [str(x).lower() for x in (it.get('tags') or [])]
-    w = (weather or '').lower()
-    if 'rain' in w and any(k in tags for k in ['indoor','cafe','museum']):
-        sc += 0.7
-    if tm:
-        hour = tm if isinstance(tm, int) else time.localtime().tm_hour
-        if hour >= 20 or hour < 6:
-            if 'open_late' in tags or 'tea stall' in ' '.join(tags):
-                sc += 0.5
-    try:
-        t = float(temp_c) if temp_c is not None else None
-    except Exception:
-        t = None
-    if t is not None and t > 35 and any(k in tags for k in ['waterfront','shade','indoor']):
-        sc += 0.5
-    return sc
-
-def _intent_score(it, intent: str | None):
-    if not intent:
-        return 0.0
-    intent = intent.lower()
-    tags = [str(x).lower() for x in (it.get('tags') or [])]
-    if intent == 'food':
-        return 0.6 if any(x in ' '.join(tags) for x in ['street-food','cafe','tea','restaurant']) else 0.0
-    if intent == 'photography':
-        return 0.6 if any(x in tags for x in ['iconic','heritage','river-view','architecture']) else 0.0
-    if intent == 'history':
-        return 0.6 if any(x in tags for x in ['heritage','historical','museum']) else 0.0
-    if intent == 'quiet':
-        return 0.6 if any(x in tags for x in ['peaceful','quiet','park','open-space']) else 0.0
-    return 0.0
+    job = jobs.submit('reindex', _run_reindex)
+    return jsonify({
+        'ok': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"/reindex/{job['id']}",
+        'message': 'Reindex started.' if job['status'] == 'queued' else 'Reindex already in progress.',
+    }), 202
+
+@app.get('/reindex/<job_id>')
+def reindex_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'ok': False, 'error': 'unknown job'}), 404
+    return jsonify({'ok': True, **job})
+
+def _run_reindex(job):
+    root = os.path.dirname(__file__)
+    script = os.path.join(root, 'utils', 'build_index.py')
+    out = new_version_dir(rag.index_root)
+    jobs.update(job, message='Building index...')
+    proc = subprocess.run(['python', script, '--incremental', '--out', out], capture_output=True, text=True)
+    if proc.returncode != 0:
+        shutil.rmtree(out, ignore_errors=True)
+        tail = (proc.stderr or proc.stdout or '').strip().splitlines()[-1:]
+        jobs.update(job, message=f"Reindex skipped: {tail[0] if tail else 'build failed'}")
+        raise RuntimeError(job['message'])
+    jobs.update(job, message='Swapping in new index...')
+    rag.swap_index(out, keep=int(os.getenv('INDEX_KEEP_VERSIONS', '3')))
+    jobs.update(job, message='Index rebuilt.')
+    return {'version': os.path.basename(out), 'index_version': rag.version}
 
 def _llm_narration_ollama(top, user_pref, weather, hour, temp_c):
-    if not requests:
+    if get_client() is None:
         return None
 
 def _llm_chat_ollama(user_msg: str, context_items, user_pref, hour):
-    if not requests:
+    client = get_client()
+    if client is None:
         return None
     try:
         ctx_lines = []
@@ -288,15 +275,7 @@ def _llm_chat_ollama(user_msg: str, context_items, user_pref, hour):
             "Context candidates:\n" + "\n".join(ctx_lines) + "\n"
             "Assistant: Suggest 2-3 relevant places with a local tip. Avoid long lists and avoid markdown bullets."
         )
-        resp = requests.post(
-            'http://127.0.0.1:11434/api/generate',
-            json={'model': 'tinyllama', 'prompt': prompt, 'stream': False},
-            timeout=3.5
-        )
-        if resp.status_code == 200:
-            data = resp.json()
-            txt = (data.get('response') or '').strip()
-            return txt or None
+        return client.generate(prompt, model='tinyllama', timeout=3.5)
     except Exception:
         return None
     return None
@@ -312,27 +291,43 @@ def _llm_chat_ollama(user_msg: str, context_items, user_pref, hour):
             f"Candidate stops: {names}. "
             + ("If a tea stall is relevant, mention exactly one." if tea_present else "")
         )
-        resp = requests.post(
-            'http://127.0.0.1:11434/api/generate',
-            json={'model': 'tinyllama', 'prompt': prompt, 'stream': False},
-            timeout=3.5
-        )
-        if resp.status_code == 200:
-            data = resp.json()
-            txt = (data.get('response') or '').strip()
-            return txt or None
+        return client.generate(prompt, model='tinyllama', timeout=3.5)
     except Exception:
         return None
     return None
 
+def _route_path(data):
+    """Route as (lat, lng) points: an encoded `polyline`, a `waypoints` list
+    ([lat, lng] pairs or {lat, lng} objects), or the straight line from
+    user_lat/user_lng to dest_lat/dest_lng.
+    """
+    if data.get('polyline'):
+        path = decode_polyline(str(data['polyline']), int(data.get('polyline_precision') or 5))
+    elif data.get('waypoints'):
+        path = []
+        for wp in data['waypoints']:
+            if isinstance(wp, dict):
+                path.append((float(wp['lat']), float(wp.get('lng', wp.get('lon')))))
+            else:
+                path.append((float(wp[0]), float(wp[1])))
+    else:
+        path = [
+            (float(data.get('user_lat') or 0), float(data.get('user_lng') or 0)),
+            (float(data.get('dest_lat') or 0), float(data.get('dest_lng') or 0)),
+        ]
+    if not path:
+        raise ValueError('empty route')
+    return path
+
 @app.post('/route_suggestions')
 def route_suggestions():
     data = request.get_json(silent=True) or {}
     user_id = data.get('user_id', 'anon')
-    a_lat = float(data.get('user_lat') or 0)
-    a_lng = float(data.get('user_lng') or 0)
-    b_lat = float(data.get('dest_lat') or 0)
-    b_lng = float(data.get('dest_lng') or 0)
+    try:
+        path = _route_path(data)
+    except (TypeError, ValueError, KeyError, IndexError):
+        return jsonify({'suggestions': [], 'error': 'invalid polyline or waypoints'}), 400
+    a_lat, a_lng = path[0]
     weather = data.get('weather')
     tm = data.get('hour')
     temp_c = data.get('temp_c')
@@ -342,40 +337,37 @@ def route_suggestions():
     tolerance = (data.get('tolerance') or {})
     walk_km = float(tolerance.get('walking_distance_km') or 1.2)
     intent = data.get('intent')
-    pool = rag.items
-    near = []
-    for it in pool:
-        lat = float(it.get('lat') or 0)
-        lng = float(it.get('lng') or 0)
-        if lat == 0 and lng == 0:
-            continue
-        dseg = _point_segment_distance_km(a_lat, a_lng, b_lat, b_lng, lat, lng)
-        if dseg <= float(data.get('threshold_km') or walk_km):
-            near.append((dseg, it))
+    # spatial grid: only items in cells along the route corridor are checked
+    near = rag.near_route(path, float(data.get('threshold_km') or walk_km))
     user_pref = prefs.get(user_id)
+    detours = haversine_many_km(
+        a_lat, a_lng,
+        [float(it.get('lat') or 0) for _, _, it in near],
+        [float(it.get('lng') or 0) for _, _, it in near],
+    ).tolist()
+    sc = score_pool(rag.tag_features, [it for _, _, it in near], user_pref, weather, tm, temp_c, intent)
+    # detour tolerance based on transport and available time
+    detour_cap = 0.6 if transport in ('walk','scooter') else (1.2 if transport=='car' else 0.8)
+    if avail_min < 20:
+        detour_cap *= 0.7
+    # crowd penalty if calm mood
+    calm = str(user_pref.get('mood') or '').lower() == 'calm'
     scored = []
-    for dseg, it in near:
-        detour = _haversine_km(a_lat, a_lng, float(it.get('lat') or 0), float(it.get('lng') or 0))
-        psc = _personalization_score(it, user_pref)
-        csc = _context_score(it, weather, tm, temp_c)
-        isc = _intent_score(it, intent)
-        # detour tolerance based on transport and available time
-        detour_cap = 0.6 if transport in ('walk','scooter') else (1.2 if transport=='car' else 0.8)
-        if avail_min < 20:
-            detour_cap *= 0.7
-        # crowd penalty if calm mood
-        mood = str(user_pref.get('mood') or '').lower()
-        tags = [str(x).lower() for x in (it.get('tags') or [])]
-        crowd_pen = 0.5 if (mood=='calm' and any(x in tags for x in ['busy','crowd','nightlife'])) else 0.0
+    for j, ((dseg, along, it), detour) in enumerate(zip(near, detours)):
+        psc, csc, isc = float(sc['personal'][j]), float(sc['context'][j]), float(sc['intent'][j])
+        crowd_pen = 0.5 if (calm and sc['crowded'][j]) else 0.0
 
         detour_term = 0.6/(1.0+max(0.0, detour - detour_cap))
         total = 1.4/(1.0+dseg) + detour_term + 0.9*psc + 0.7*csc + 0.5*isc - crowd_pen
         it2 = dict(it)
         it2['route_distance_km'] = round(dseg, 2)
+        it2['route_position_km'] = round(along, 2)
         it2['score'] = round(total, 3)
         scored.append(it2)
     scored.sort(key=lambda x: x.get('score', 0), reverse=True)
     top = scored[: int(data.get('k') or 5)]
+    # present the chosen stops in the order they come up along the trip
+    top.sort(key=lambda x: x['route_position_km'])
     # Try local TinyLlama (Ollama) narration; fallback to template
     llm_text = _llm_narration_ollama(top, user_pref, weather, tm, temp_c)
     if not llm_text:
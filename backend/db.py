@@ -1,5 +1,8 @@
 import os
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -9,3 +12,37 @@ enable_db = bool(DATABASE_URL)
 engine = create_engine(DATABASE_URL, pool_pre_ping=True) if enable_db else None
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) if enable_db else None
 Base = declarative_base()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(bind=None) -> Iterator[QueryCounter]:
+    """Record every SQL statement executed on `bind` (default: the app engine) inside the block."""
+    bind = bind or engine
+    counter = QueryCounter()
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(bind, 'before_cursor_execute', _record)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, 'before_cursor_execute', _record)
+
+
+@contextmanager
+def assert_max_queries(n: int, bind=None) -> Iterator[QueryCounter]:
+    """Fail if the block runs more than `n` statements, e.g. to catch N+1 loading in tests."""
+    with count_queries(bind) as counter:
+        yield counter
+    if counter.count > n:
+        raise AssertionError(f'expected at most {n} queries, got {counter.count}:\n' + '\n'.join(counter.statements))
@@ -37,3 +37,12 @@ class PlaceImage(Base):
     sort_order = Column(Integer, default=0)
 
     place = relationship('Place', back_populates='images')
+
+class PlaceCategory(Base):
+    """Canonical category/subcategory/tag labels, rebuilt at ingest (schema.refresh_categories)."""
+    __tablename__ = 'place_categories'
+
+    kind = Column(String, primary_key=True)  # 'category' | 'subcategory' | 'tag'
+    slug = Column(Text, primary_key=True)  # normalized label, as in places.*_norm
+    label = Column(Text, nullable=False)  # most common original spelling
+    place_count = Column(Integer, nullable=False, default=0)
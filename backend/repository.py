@@ -1,8 +1,104 @@
-from typing import List, Dict, Optional, Tuple
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func, or_, text
-from .models import Place, PlaceImage
-import math
+import base64
+import json
+import os
+from typing import Any, List, Dict, Optional, Tuple
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import Float, any_, bindparam, false, select, func, or_, text, literal_column, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Text
+from .models import Place, PlaceCategory, PlaceImage
+from .schema import normalize_label
+from backend.utils.cache import LRUCache
+from backend.utils.geo import haversine_many_km
+import numpy as np
+
+# nearest places fetched by KNN before scoring; the rest of the table is never read
+RECOMMEND_KNN_POOL = int(os.getenv('RECOMMEND_KNN_POOL', '200'))
+
+# engine url -> detected features; re-detected every CAPABILITIES_TTL_SEC so a running API
+# picks up columns/tables added by a later ensure_schema or ingest (0 = until restart)
+_capabilities = LRUCache(maxsize=64, ttl=float(os.getenv('CAPABILITIES_TTL_SEC', '300')))
+
+# (engine, category, subcategory, exact) -> row count; totals are informational, so a few minutes stale is fine
+_count_cache = LRUCache(maxsize=1024, ttl=float(os.getenv('PLACES_COUNT_TTL_SEC', '300')))
+
+
+def _probe(db: Session, sql: str) -> List[Any]:
+    """Rows of a detection query; [] (and the failed transaction rolled back) on error."""
+    try:
+        return list(db.execute(text(sql)))
+    except Exception:
+        db.rollback()
+        return []
+
+
+def capabilities(db: Session) -> Dict[str, Any]:
+    """Optional database features set up by schema.ensure_schema, detected per engine.
+
+    Each feature is probed on its own, so a missing table or extension only
+    disables the paths that need it.
+    """
+    bind = db.get_bind()
+    key = str(bind.url)
+    caps = _capabilities.get(key)
+    if caps is None:
+        caps = {'geo': None, 'fts': False, 'trgm': False, 'categories': False}
+        if bind.dialect.name == 'postgresql':
+            cols = {r[0] for r in _probe(
+                db, "SELECT column_name FROM information_schema.columns WHERE table_name = 'places'"
+            )}
+            exts = {r[0] for r in _probe(db, 'SELECT extname FROM pg_extension')}
+            caps['fts'] = 'search_tsv' in cols
+            caps['trgm'] = 'pg_trgm' in exts
+            if 'geog' in cols and 'postgis' in exts:
+                caps['geo'] = 'postgis'
+            elif 'earthdistance' in exts:
+                caps['geo'] = 'earthdistance'
+            if 'tags_norm' in cols and _probe(
+                db, "SELECT 1 FROM information_schema.tables WHERE table_name = 'place_categories'"
+            ):
+                caps['categories'] = bool(_probe(db, 'SELECT 1 FROM place_categories LIMIT 1'))
+        _capabilities.put(key, caps)
+    return caps
+
+
+def reset_capabilities() -> None:
+    _capabilities.clear()
+
+
+_NORM_COLUMNS = {'category': 'places.category_norm', 'subcategory': 'places.subcategory_norm'}
+
+
+def _category_filter(db: Session, value: str, kinds=('category', 'subcategory', 'tag')):
+    """WHERE clause matching places whose category, subcategory or tags contain `value`.
+
+    With the normalized columns in place, `value` is first resolved to
+    canonical labels through the small place_categories table, so the
+    places table is hit only through equality (B-tree) and && (GIN)
+    lookups. Otherwise falls back to ILIKE scans.
+    """
+    if not capabilities(db)['categories']:
+        cat = value.strip()
+        ilikes = {
+            'category': Place.category.ilike(f"%{cat}%"),
+            'subcategory': Place.subcategory.ilike(f"%{cat}%"),
+            'tag': func.array_to_string(Place.sentiment_tags, ',').ilike(f"%{cat}%"),
+        }
+        return or_(*(ilikes[k] for k in kinds))
+
+    slug = normalize_label(value)
+    matches: Dict[str, List[str]] = {k: [] for k in kinds}
+    for kind, s in db.query(PlaceCategory.kind, PlaceCategory.slug).filter(
+        PlaceCategory.kind.in_(kinds), PlaceCategory.slug.contains(slug, autoescape=True)
+    ):
+        matches[kind].append(s)
+    conds = []
+    for kind in ('category', 'subcategory'):
+        if matches.get(kind):
+            conds.append(literal_column(_NORM_COLUMNS[kind]) == any_(bindparam(None, matches[kind], type_=ARRAY(Text))))
+    if matches.get('tag'):
+        conds.append(literal_column('places.tags_norm', ARRAY(Text)).op('&&')(bindparam(None, matches['tag'], type_=ARRAY(Text))))
+    return or_(*conds) if conds else false()
 
 
 def paginate(query, page: int, page_size: int):
@@ -32,92 +128,101 @@ def place_to_dict(p: Place) -> Dict:
     }
 
 
-def get_places(db: Session, category: Optional[str], subcategory: Optional[str], page: int, page_size: int) -> Tuple[List[Dict], int]:
+def encode_cursor(name: str, place_id: str) -> str:
+    """Opaque keyset cursor for the row after which the next page starts."""
+    raw = json.dumps([name, place_id], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        name, place_id = json.loads(raw.decode('utf-8'))
+        return str(name), str(place_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def _places_query(db: Session, category: Optional[str], subcategory: Optional[str]):
     q = db.query(Place)
     if category:
-        cat = category.strip()
-        q = q.filter(
-            or_(
-                Place.category.ilike(f"%{cat}%"),
-                Place.subcategory.ilike(f"%{cat}%"),
-                func.array_to_string(Place.sentiment_tags, ',').ilike(f"%{cat}%"),
-            )
-        )
+        q = q.filter(_category_filter(db, category))
     if subcategory:
-        q = q.filter(Place.subcategory.ilike(f"%{subcategory.strip()}%"))
-    total = q.count()
-    items = paginate(q.order_by(Place.name.asc()), page, page_size).all()
+        q = q.filter(_category_filter(db, subcategory, kinds=('subcategory',)))
+    return q
+
+
+def count_places(db: Session, category: Optional[str], subcategory: Optional[str], exact: bool = True) -> int:
+    """Row count for a filter combination, cached for PLACES_COUNT_TTL_SEC.
+
+    With exact=False and no filters on Postgres, the planner's row
+    estimate is used instead of a scan.
+    """
+    bind = db.get_bind()
+    key = (str(bind.url), (category or '').strip().lower(), (subcategory or '').strip().lower(), exact)
+    total = _count_cache.get(key)
+    if total is not None:
+        return total
+    total = None
+    if not exact and not category and not subcategory and bind.dialect.name == 'postgresql':
+        est = db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'places'")).scalar()
+        if est is not None and est >= 0:
+            total = int(est)
+    if total is None:
+        total = _places_query(db, category, subcategory).count()
+    _count_cache.put(key, total)
+    return total
+
+
+def get_places(db: Session, category: Optional[str], subcategory: Optional[str], page: int, page_size: int) -> Tuple[List[Dict], int]:
+    q = _places_query(db, category, subcategory)
+    total = count_places(db, category, subcategory)
+    # images for the whole page in one extra SELECT ... IN, not one per place
+    items = paginate(q.options(selectinload(Place.images)).order_by(Place.name.asc(), Place.id.asc()), page, page_size).all()
     return [place_to_dict(p) for p in items], total
 
 
+def get_places_after(db: Session, category: Optional[str], subcategory: Optional[str], page_size: int,
+                     cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Keyset page ordered by (name, id): constant cost however deep the client scrolls.
+
+    Returns the items and the cursor for the next page (None on the last page).
+    """
+    q = _places_query(db, category, subcategory)
+    if cursor:
+        q = q.filter(tuple_(Place.name, Place.id) > tuple_(*decode_cursor(cursor)))
+    rows = (
+        q.options(selectinload(Place.images))
+        .order_by(Place.name.asc(), Place.id.asc())
+        .limit(page_size + 1)
+        .all()
+    )
+    nxt = encode_cursor(rows[page_size - 1].name, rows[page_size - 1].id) if len(rows) > page_size else None
+    return [place_to_dict(p) for p in rows[:page_size]], nxt
+
+
 def search_places(db: Session, query: str, k: int, category: Optional[str]) -> List[Dict]:
     qstr = query.strip()
-    base = db.query(Place)
+    base = db.query(Place).options(selectinload(Place.images))
     if category:
-        cat = category.strip()
-        base = base.filter(
-            or_(
-                Place.category.ilike(f"%{cat}%"),
-                Place.subcategory.ilike(f"%{cat}%"),
-                func.array_to_string(Place.sentiment_tags, ',').ilike(f"%{cat}%"),
-            )
-        )
+        base = base.filter(_category_filter(db, category))
     if not qstr:
         items = base.order_by(Place.name.asc()).limit(k).all()
         return [place_to_dict(p) for p in items]
 
-
-def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    R = 6371.0
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dl = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dl/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
-
-
-def recommend_places(db: Session, user_lat: float, user_lng: float, k: int = 10,
-                     include_tags: Optional[List[str]] = None,
-                     category: Optional[str] = None) -> List[Dict]:
-    q = db.query(Place)
-    if category:
-        cat = category.strip()
-        q = q.filter(
-            or_(
-                Place.category.ilike(f"%{cat}%"),
-                Place.subcategory.ilike(f"%{cat}%"),
-                func.array_to_string(Place.sentiment_tags, ',').ilike(f"%{cat}%"),
-            )
-        )
-    # Pull a reasonable pool; refine later with geo index
-    pool: List[Place] = q.limit(500).all()
-
-    tags_norm = [t.strip().lower() for t in (include_tags or []) if t]
-    scored: List[Tuple[float, Place]] = []
-    for p in pool:
-        try:
-            d = _haversine_km(float(p.lat or 0), float(p.lng or 0), user_lat, user_lng)
-        except Exception:
-            d = 9999.0
-        # smaller distance -> higher score; basic transform
-        dist_score = max(0.0, 1.0 - min(d, 20.0)/20.0)  # within 20km
-        tag_score = 0.0
-        if tags_norm and p.sentiment_tags:
-            s = {str(t).lower() for t in p.sentiment_tags}
-            tag_score = 0.3 * sum(1 for t in tags_norm if t in s)
-        total = dist_score + tag_score
-        scored.append((total, p))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top = [place_to_dict(p) for _, p in scored[:k]]
-    # Attach distance for client sorting/debug
-    for it in top:
-        try:
-            it['distance_km'] = round(_haversine_km(it.get('lat', 0), it.get('lng', 0), user_lat, user_lng), 2)
-        except Exception:
-            it['distance_km'] = None
-    return top
+    caps = capabilities(db)
+    if caps['fts']:
+        # GIN-indexed weighted tsvector (name A, category/tags B, description C, history D)
+        tsv = literal_column('places.search_tsv')
+        tsq = func.websearch_to_tsquery('english', qstr)
+        match = tsv.op('@@')(tsq)
+        order = [func.ts_rank(tsv, tsq).desc()]
+        if caps['trgm']:
+            # trigram GIN index on name: substring and typo-tolerant name hits
+            match = or_(match, Place.name.ilike(f"%{qstr}%"), Place.name.op('%')(qstr))
+            order.append(func.similarity(Place.name, qstr).desc())
+        items = base.filter(match).order_by(*order, Place.name.asc()).limit(k).all()
+        return [place_to_dict(p) for p in items]
 
     # Search across name, description, category, subcategory, tags
     items = (
@@ -136,3 +241,106 @@ def recommend_places(db: Session, user_lat: float, user_lng: float, k: int = 10,
         .all()
     )
     return [place_to_dict(p) for p in items]
+
+
+def _geo_distance_km(kind: str, user_lat: float, user_lng: float):
+    """(distance in km, KNN ordering expression) served by the GiST index for `kind`."""
+    if kind == 'postgis':
+        geog = literal_column('places.geog')
+        pt = func.geography(func.ST_SetSRID(func.ST_MakePoint(user_lng, user_lat), 4326))
+        return func.ST_Distance(geog, pt) / 1000.0, geog.op('<->')(pt)
+    here = func.ll_to_earth(user_lat, user_lng)
+    earth = func.ll_to_earth(Place.lat.cast(Float), Place.lng.cast(Float))
+    return func.earth_distance(earth, here) / 1000.0, earth.op('<->')(here)
+
+
+def _tag_hits(tags_norm: List[str]):
+    """Number of requested tags present (case-insensitively) in the row's sentiment_tags."""
+    wanted = func.unnest(bindparam('want_tags', tags_norm, type_=ARRAY(Text))).table_valued('tag').render_derived(name='want')
+    have = func.unnest(Place.sentiment_tags).table_valued('tag').render_derived(name='have')
+    return (
+        select(func.count())
+        .select_from(wanted)
+        .where(wanted.c.tag.in_(select(func.lower(have.c.tag)).select_from(have)))
+        .correlate(Place)
+        .scalar_subquery()
+    )
+
+
+def recommend_places(db: Session, user_lat: float, user_lng: float, k: int = 10,
+                     include_tags: Optional[List[str]] = None,
+                     category: Optional[str] = None) -> List[Dict]:
+    tags_norm = [t.strip().lower() for t in (include_tags or []) if t]
+    kind = capabilities(db)['geo']
+    if kind:
+        return _recommend_places_sql(db, kind, user_lat, user_lng, k, tags_norm, category)
+
+    # No spatial index: score the whole (filtered) table in one vectorized
+    # pass over the scoring columns only, then load the top-k places
+    q = db.query(Place.id, Place.lat, Place.lng, Place.sentiment_tags)
+    if category:
+        q = q.filter(_category_filter(db, category))
+    rows = q.all()
+
+    if not rows:
+        return []
+
+    dist = haversine_many_km(
+        user_lat, user_lng,
+        np.fromiter((float(r.lat or 0) for r in rows), dtype='float64', count=len(rows)),
+        np.fromiter((float(r.lng or 0) for r in rows), dtype='float64', count=len(rows)),
+    )
+    # smaller distance -> higher score; basic transform
+    score = np.maximum(0.0, 1.0 - np.minimum(dist, 20.0)/20.0)  # within 20km
+    if tags_norm:
+        for i, r in enumerate(rows):
+            if r.sentiment_tags:
+                s = {str(t).lower() for t in r.sentiment_tags}
+                score[i] += 0.3 * sum(1 for t in tags_norm if t in s)
+
+    order = np.argsort(-score, kind='stable')[:k].tolist()
+    ids = [rows[i].id for i in order]
+    places = {p.id: p for p in db.query(Place).options(selectinload(Place.images)).filter(Place.id.in_(ids))}
+    top = []
+    for i in order:
+        p = places.get(rows[i].id)
+        if p is None:
+            continue
+        it = place_to_dict(p)
+        # Attach distance for client sorting/debug
+        it['distance_km'] = round(float(dist[i]), 2)
+        top.append(it)
+    return top
+
+
+def _recommend_places_sql(db: Session, kind: str, user_lat: float, user_lng: float, k: int,
+                          tags_norm: List[str], category: Optional[str]) -> List[Dict]:
+    """KNN over the spatial index, then distance + tag scoring in the same query.
+
+    Only the RECOMMEND_KNN_POOL nearest rows are scored, so the cost does
+    not grow with the table. Places beyond 20 km only score through tags.
+    """
+    dist_km, knn_order = _geo_distance_km(kind, user_lat, user_lng)
+    near = db.query(Place.id.label('id'), dist_km.label('dist_km'))
+    if category:
+        near = near.filter(_category_filter(db, category))
+    near = near.order_by(knn_order).limit(max(RECOMMEND_KNN_POOL, k)).subquery('near')
+
+    # smaller distance -> higher score; within 20km
+    score = func.greatest(0.0, 1.0 - func.least(near.c.dist_km, 20.0) / 20.0)
+    if tags_norm:
+        score = score + 0.3 * _tag_hits(tags_norm)
+    rows = (
+        db.query(Place, near.c.dist_km)
+        .options(selectinload(Place.images))
+        .join(near, Place.id == near.c.id)
+        .order_by(score.desc(), near.c.dist_km.asc())
+        .limit(k)
+        .all()
+    )
+    top = []
+    for p, d in rows:
+        it = place_to_dict(p)
+        it['distance_km'] = round(float(d), 2)
+        top.append(it)
+    return top
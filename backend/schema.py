@@ -0,0 +1,156 @@
+"""Idempotent Postgres DDL beyond the ORM models (extensions, generated columns, indexes).
+
+Each step is skipped when its extension is unavailable; the repository
+detects what exists at query time and falls back otherwise.
+"""
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from .db import engine as default_engine
+from .models import Base, Place, PlaceCategory
+
+
+def normalize_label(value) -> str:
+    """Python twin of places_norm_label(): collapse whitespace, trim, lowercase."""
+    return ' '.join(str(value or '').split()).lower()
+
+
+def _try(engine, *statements: str) -> bool:
+    """Run statements in one transaction; False (rolled back) if any fails."""
+    try:
+        with engine.begin() as conn:
+            for stmt in statements:
+                conn.execute(text(stmt))
+        return True
+    except Exception:
+        return False
+
+
+def ensure_geo(engine) -> Optional[str]:
+    """Index place coordinates for KNN search: PostGIS if available, else earthdistance."""
+    if _try(
+        engine,
+        'CREATE EXTENSION IF NOT EXISTS postgis',
+        'ALTER TABLE places ADD COLUMN IF NOT EXISTS geog geography(Point, 4326) '
+        'GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(lng::float8, lat::float8), 4326)::geography) STORED',
+        'CREATE INDEX IF NOT EXISTS places_geog_gist ON places USING gist (geog)',
+    ):
+        return 'postgis'
+    if _try(
+        engine,
+        'CREATE EXTENSION IF NOT EXISTS cube',
+        'CREATE EXTENSION IF NOT EXISTS earthdistance',
+        'CREATE INDEX IF NOT EXISTS places_earth_gist ON places USING gist (ll_to_earth(lat::float8, lng::float8))',
+    ):
+        return 'earthdistance'
+    return None
+
+
+# array_to_string is only STABLE, which generated columns reject; tags are plain text
+TAGS_TEXT_FN = """
+CREATE OR REPLACE FUNCTION places_tags_text(tags text[]) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT coalesce(array_to_string(tags, ' '), '') $$
+"""
+
+SEARCH_TSV = (
+    "setweight(to_tsvector('english'::regconfig, coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(category, '') || ' ' || coalesce(subcategory, '')), 'B') || "
+    "setweight(to_tsvector('english'::regconfig, places_tags_text(sentiment_tags)), 'B') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(description, '')), 'C') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(history, '')), 'D')"
+)
+
+
+def ensure_fts(engine) -> bool:
+    """Weighted full-text column with a GIN index."""
+    return _try(
+        engine,
+        TAGS_TEXT_FN,
+        f'ALTER TABLE places ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS ({SEARCH_TSV}) STORED',
+        'CREATE INDEX IF NOT EXISTS places_search_tsv_gin ON places USING gin (search_tsv)',
+    )
+
+
+def ensure_trgm(engine) -> bool:
+    """Trigram index on name for ILIKE and fuzzy (%) name matching."""
+    return _try(
+        engine,
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX IF NOT EXISTS places_name_trgm ON places USING gin (name gin_trgm_ops)',
+    )
+
+
+CATEGORY_FNS = (
+    r"""
+CREATE OR REPLACE FUNCTION places_norm_label(t text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT lower(btrim(regexp_replace(t, '\s+', ' ', 'g'))) $$
+""",
+    """
+CREATE OR REPLACE FUNCTION places_norm_tags(tags text[]) RETURNS text[]
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+SELECT coalesce(array_agg(places_norm_label(t)), '{}') FROM unnest(tags) AS t
+$$
+""",
+)
+
+
+def ensure_categories(engine) -> bool:
+    """Normalized category/subcategory/tag columns with B-tree and GIN indexes."""
+    return _try(
+        engine,
+        *CATEGORY_FNS,
+        'ALTER TABLE places ADD COLUMN IF NOT EXISTS category_norm text '
+        'GENERATED ALWAYS AS (places_norm_label(category)) STORED',
+        'ALTER TABLE places ADD COLUMN IF NOT EXISTS subcategory_norm text '
+        'GENERATED ALWAYS AS (places_norm_label(subcategory)) STORED',
+        'ALTER TABLE places ADD COLUMN IF NOT EXISTS tags_norm text[] '
+        'GENERATED ALWAYS AS (places_norm_tags(sentiment_tags)) STORED',
+        'CREATE INDEX IF NOT EXISTS places_category_norm ON places (category_norm)',
+        'CREATE INDEX IF NOT EXISTS places_subcategory_norm ON places (subcategory_norm)',
+        'CREATE INDEX IF NOT EXISTS places_tags_norm_gin ON places USING gin (tags_norm)',
+    )
+
+
+def refresh_categories(db) -> int:
+    """Rebuild place_categories from the places table; call after ingest commits."""
+    counts: Dict[tuple, int] = Counter()
+    spellings: Dict[tuple, Counter] = defaultdict(Counter)
+
+    def add(kind: str, value) -> None:
+        slug = normalize_label(value)
+        if slug:
+            counts[(kind, slug)] += 1
+            spellings[(kind, slug)][str(value).strip()] += 1
+
+    for category, subcategory, tags in db.query(Place.category, Place.subcategory, Place.sentiment_tags):
+        add('category', category)
+        add('subcategory', subcategory)
+        for tag in set(tags or []):
+            add('tag', tag)
+    db.query(PlaceCategory).delete()
+    db.add_all([
+        PlaceCategory(kind=kind, slug=slug, label=spellings[(kind, slug)].most_common(1)[0][0], place_count=n)
+        for (kind, slug), n in counts.items()
+    ])
+    db.commit()
+    from .repository import reset_capabilities
+    reset_capabilities()
+    return len(counts)
+
+
+def ensure_keyset(engine) -> bool:
+    """Composite index serving (name, id) keyset pagination."""
+    return _try(engine, 'CREATE INDEX IF NOT EXISTS places_name_id ON places (name, id)')
+
+
+def ensure_schema(engine=None) -> Dict[str, Any]:
+    """Create tables plus the optional indexes; returns what was set up."""
+    engine = engine or default_engine
+    Base.metadata.create_all(bind=engine)
+    caps = {'geo': ensure_geo(engine), 'fts': ensure_fts(engine), 'trgm': ensure_trgm(engine),
+            'keyset': ensure_keyset(engine), 'categories': ensure_categories(engine)}
+    from .repository import reset_capabilities
+    reset_capabilities()
+    return caps
@@ -6,7 +6,8 @@ from typing import Dict, List, Tuple
 import requests
 
 from ..db import enable_db, SessionLocal, engine
-from ..models import Base, Place, PlaceImage
+from ..models import Place, PlaceImage
+from ..schema import ensure_schema, refresh_categories
 
 # Default Kolkata bbox: south,west,north,east (lat,lon)
 DEFAULT_BBOX = (22.45, 88.20, 22.75, 88.50)
@@ -141,7 +142,7 @@ def upsert(db, data: Dict):
 def fetch_and_ingest(bbox: Tuple[float,float,float,float]):
     if not enable_db:
         raise SystemExit("DATABASE_URL not set. Export DATABASE_URL and retry.")
-    Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
 
     query = build_query(bbox)
     resp = requests.post(OVERPASS_URL, data={"data": query}, timeout=OSM_TIMEOUT+10)
@@ -161,6 +162,7 @@ def fetch_and_ingest(bbox: Tuple[float,float,float,float]):
             except Exception:
                 continue
         db.commit()
+        refresh_categories(db)
     print(f"Auto-ingest OSM: upserted {n} places.")
 
 
@@ -5,7 +5,8 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 
 from ..db import SessionLocal, engine, enable_db
-from ..models import Place, PlaceImage, Base
+from ..models import Place, PlaceImage
+from ..schema import ensure_schema, refresh_categories
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'kolkata_places.json')
 DATA_PATH = os.path.abspath(DATA_PATH)
@@ -74,8 +75,9 @@ def main():
     if not enable_db:
         raise SystemExit("DATABASE_URL not set. Export DATABASE_URL and try again.")
 
-    # Ensure tables exist (for quick bootstrap; prefer Alembic in real use)
-    Base.metadata.create_all(bind=engine)
+    # Ensure tables and search/geo indexes exist (for quick bootstrap; prefer Alembic in real use)
+    caps = ensure_schema(engine)
+    print(f"Schema ready: {caps}")
 
     with open(DATA_PATH, 'r', encoding='utf-8') as f:
         items: List[Dict] = json.load(f)
@@ -90,6 +92,7 @@ def main():
                 data['id'] = '21' + data['id']
             upsert_place(db, data)
         db.commit()
+        refresh_categories(db)
     print(f"Ingested {len(items)} items into the database.")
 
 
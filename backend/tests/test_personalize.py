@@ -0,0 +1,49 @@
+import time
+
+from sqlalchemy import create_engine
+
+from backend.utils.personalize import PreferenceStore, SQLPrefsBackend
+
+
+def _stores(tmp_path, ttl=0.5):
+    backend = SQLPrefsBackend(create_engine(f"sqlite:///{tmp_path / 'prefs.sqlite3'}"))
+    make = lambda: PreferenceStore(backend=backend, cache_ttl=ttl, flush_interval=3600)
+    return backend, make(), make()
+
+
+def test_active_reader_sees_other_workers_writes(tmp_path):
+    _, a, b = _stores(tmp_path)
+    assert a.get('u')['mood'] is None
+    b.update_explicit('u', {'mood': 'calm'})
+    b.flush()
+    deadline = time.monotonic() + 1.5
+    while a.get('u')['mood'] != 'calm' and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert a.get('u')['mood'] == 'calm'
+
+
+def test_flush_merges_instead_of_overwriting(tmp_path):
+    backend, a, b = _stores(tmp_path, ttl=60)
+    a.get('u')
+    b.update_explicit('u', {'mood': 'calm'})
+    b.flush()
+    # a still holds the profile it loaded before b's write
+    a.update_explicit('u', {'companion': 'family'})
+    a.update_from_interaction('u', 'tea stalls near the river', '')
+    a.flush()
+    stored = backend.load('u')
+    assert stored['mood'] == 'calm'
+    assert stored['companion'] == 'family'
+    assert stored['last_queries'] == ['tea stalls near the river']
+    # the flush also refreshed a's view with the merged row
+    assert a.get('u')['mood'] == 'calm'
+
+
+def test_edit_during_flush_is_not_lost(tmp_path):
+    backend, a, _ = _stores(tmp_path, ttl=60)
+    a.update_explicit('u', {'mood': 'calm'})
+    a.flush()
+    a.update_explicit('u', {'companion': 'friends'})
+    a.flush()
+    stored = backend.load('u')
+    assert (stored['mood'], stored['companion']) == ('calm', 'friends')
@@ -0,0 +1,76 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence
+
+
+class MicroBatcher:
+    """Coalesce single-item calls from many threads into batched calls.
+
+    Requests arriving within `max_wait_ms` of the first queued one (up to
+    `max_batch`) are handed to `fn` as one list; `fn` must return one
+    result per input, in order. Identical inputs in a batch are computed
+    once.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], Sequence[Any]], max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._queue: 'queue.Queue[tuple]' = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any) -> Future:
+        fut: Future = Future()
+        self._queue.put((item, fut))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                    self._thread.start()
+        return fut
+
+    def __call__(self, item: Any, timeout: float = None) -> Any:
+        return self.submit(item).result(timeout)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[tuple]) -> None:
+        unique: Dict[Any, int] = {}
+        for item, _ in batch:
+            unique.setdefault(item, len(unique))
+        try:
+            results = self.fn(list(unique))
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(batch)
+        for item, fut in batch:
+            fut.set_result(results[unique[item]])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch': round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
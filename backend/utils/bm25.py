@@ -0,0 +1,80 @@
+import math
+import re
+from heapq import nlargest
+from typing import Container, Dict, List, Optional, Sequence, Tuple
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with a light plural strip ("temples" -> "temple")."""
+    out = []
+    for tok in _TOKEN_RE.findall(str(text or '').lower()):
+        if len(tok) > 3 and tok.endswith('s') and not tok.endswith('ss'):
+            tok = tok[:-1]
+        out.append(tok)
+    return out
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring.
+
+    Term weights are query independent, so each posting stores its final
+    BM25 contribution and a query is just a sum over a few posting lists.
+    """
+
+    def __init__(self, docs: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(docs)
+        self._postings: Dict[str, Dict[int, float]] = {}
+
+        tfs: List[Dict[str, int]] = []
+        lengths: List[int] = []
+        df: Dict[str, int] = {}
+        for text in docs:
+            tf: Dict[str, int] = {}
+            toks = tokenize(text)
+            for tok in toks:
+                tf[tok] = tf.get(tok, 0) + 1
+            for tok in tf:
+                df[tok] = df.get(tok, 0) + 1
+            tfs.append(tf)
+            lengths.append(len(toks))
+
+        avgdl = (sum(lengths) / len(lengths)) if lengths else 0.0
+        idf = {tok: math.log(1.0 + (self.n_docs - n + 0.5) / (n + 0.5)) for tok, n in df.items()}
+        postings: Dict[str, Dict[int, float]] = {tok: {} for tok in df}
+        for doc, (tf, dl) in enumerate(zip(tfs, lengths)):
+            norm = k1 * (1.0 - b + b * (dl / avgdl if avgdl else 0.0))
+            for tok, f in tf.items():
+                postings[tok][doc] = idf[tok] * f * (k1 + 1.0) / (f + norm)
+        self._postings = postings
+
+    def search(self, query: str, k: int, allowed: Optional[Container[int]] = None) -> List[Tuple[float, int]]:
+        """Return up to k (score, doc) pairs, best first.
+
+        Documents containing every query term are scored on their own when
+        there are at least k of them; otherwise the union is scored.
+        """
+        terms = set(tokenize(query))
+        lists = sorted((self._postings[t] for t in terms if t in self._postings), key=len)
+        if not lists or k <= 0:
+            return []
+
+        pool = set(lists[0]).intersection(*lists[1:])
+        if allowed is not None:
+            pool = {d for d in pool if d in allowed}
+        if len(pool) < k:
+            pool = None
+
+        acc: Dict[int, float] = {}
+        for plist in lists:
+            for doc, w in plist.items():
+                if pool is not None:
+                    if doc not in pool:
+                        continue
+                elif allowed is not None and doc not in allowed:
+                    continue
+                acc[doc] = acc.get(doc, 0.0) + w
+        return [(s, d) for d, s in nlargest(k, acc.items(), key=lambda x: (x[1], -x[0]))]
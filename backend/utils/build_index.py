@@ -1,5 +1,9 @@
 import os
 import json
+import time
+import hashlib
+import shutil
+import argparse
 import numpy as np
 from pathlib import Path
 from typing import List, Dict
@@ -10,6 +14,20 @@ from sentence_transformers import SentenceTransformer
 DATA_JSON = os.path.join(os.path.dirname(__file__), '..', 'data', 'kolkata_places.json')
 INDEX_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'faiss_index')
 MODEL_NAME = os.getenv('MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
+SIMILAR_TOP_N = int(os.getenv('SIMILAR_TOP_N', '20'))
+INDEX_TYPES = ('flat', 'hnsw', 'ivf', 'ivfpq')
+
+
+def active_index_dir(root: str) -> str:
+    # mirrors rag_pipeline.resolve_index_dir; this script runs standalone
+    try:
+        with open(os.path.join(root, 'CURRENT'), 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+        if name and os.path.isdir(os.path.join(root, 'versions', name)):
+            return os.path.join(root, 'versions', name)
+    except OSError:
+        pass
+    return root
 
 
 def load_items(path: str) -> List[Dict]:
@@ -17,6 +35,8 @@ def load_items(path: str) -> List[Dict]:
         items = json.load(f)
     # ensure fields exist
     for it in items:
+        # meta rows carry the item id so the server can enrich hits without name matching
+        it['id'] = str(it.get('id') or '')
         it.setdefault('city', 'Kolkata')
         it.setdefault('type', 'place')
         it.setdefault('story', it.get('description', ''))
@@ -42,23 +62,349 @@ def text_for_embedding(it: Dict) -> str:
     return '. '.join([p for p in parts if p])
 
 
-def main():
-    items = load_items(os.path.abspath(DATA_JSON))
-    model = SentenceTransformer(MODEL_NAME)
+def content_hash(it: Dict) -> str:
+    """Hash of the embedded text and model; unchanged hashes skip re-encoding."""
+    return hashlib.sha1(f'{MODEL_NAME}\n{text_for_embedding(it)}'.encode('utf-8')).hexdigest()
+
+
+def build_neighbors(index, X: np.ndarray, items: List[Dict], top_n: int,
+                    labels: np.ndarray = None, rows: List[int] = None) -> Dict[str, List]:
+    """Top-N neighbour ids and scores per item, served by /similar as a table lookup.
+
+    `labels` are the FAISS ids of the rows of X (default: row numbers);
+    `rows` restricts the computation to a subset of items.
+    """
+    if len(items) < 2 or top_n <= 0:
+        return {}
+    labels = np.arange(len(items)) if labels is None else labels
+    row_of = {int(l): r for r, l in enumerate(labels.tolist())}
+    rows = list(range(len(items))) if rows is None else rows
+    if not rows:
+        return {}
+    scores, idxs = index.search(np.ascontiguousarray(X[rows]), min(top_n + 1, len(items)))
+    table: Dict[str, List] = {}
+    for row, ids, scs in zip(rows, idxs.tolist(), scores.tolist()):
+        nbrs = []
+        for label, sc in zip(ids, scs):
+            j = row_of.get(label)
+            if j is None or j == row:
+                continue
+            nbrs.append([items[j]['id'], round(float(sc), 6)])
+        table[items[row]['id']] = nbrs[:top_n]
+    return table
+
+
+def _largest_divisor(n: int, cap: int) -> int:
+    for m in range(max(1, min(cap, n)), 0, -1):
+        if n % m == 0:
+            return m
+    return 1
+
+
+def make_index(X: np.ndarray, kind: str = 'flat', nlist: int = 0, hnsw_m: int = 32,
+               ef_construction: int = 200, pq_m: int = 16, pq_bits: int = 8,
+               nprobe: int = 8, ef_search: int = 64, labels: np.ndarray = None):
+    """Build and fill an inner-product index of the given type.
+
+    IVF variants are trained on X; nlist defaults to ~4*sqrt(n) and is
+    clamped so every list gets enough training points. nprobe/efSearch
+    are stored in the index as query-time defaults. With `labels` the
+    vectors are added under those ids (flat/HNSW through IndexIDMap2) so
+    later incremental updates can remove and re-add single items.
+    """
+    n, dim = X.shape
+    if kind == 'flat':
+        index = faiss.IndexFlatIP(dim)
+    elif kind == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+    elif kind in ('ivf', 'ivfpq'):
+        nlist = nlist or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n // 39 or 1))
+        quantizer = faiss.IndexFlatIP(dim)
+        if kind == 'ivf':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            m = _largest_divisor(dim, pq_m)
+            bits = max(1, min(pq_bits, int(np.log2(max(n, 2)))))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, bits, faiss.METRIC_INNER_PRODUCT)
+        index.train(X)
+        index.nprobe = min(nprobe, nlist)
+    else:
+        raise ValueError(f'unknown index type {kind!r}; expected one of {INDEX_TYPES}')
+    if labels is None:
+        index.add(X)
+        return index
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap2(index)
+    index.add_with_ids(X, np.asarray(labels, dtype='int64'))
+    return index
+
+
+def _timed_search(index, Q: np.ndarray, k: int):
+    t0 = time.perf_counter()
+    _, I = index.search(Q, k)
+    return I, (time.perf_counter() - t0) * 1000.0 / max(len(Q), 1)
+
+
+def recall_report(index, X: np.ndarray, k: int = 10, n_queries: int = 500, labels: np.ndarray = None) -> Dict:
+    """Recall@k and per-query latency of `index` against exact search, sweeping nprobe/efSearch."""
+    rng = np.random.default_rng(0)
+    Q = X[rng.choice(len(X), size=min(n_queries, len(X)), replace=False)]
+    k = min(k, len(X))
+    flat = faiss.IndexFlatIP(X.shape[1])
+    flat.add(X)
+    truth, flat_ms = _timed_search(flat, Q, k)
+    if labels is not None:
+        truth = np.asarray(labels)[truth]
+
+    def recall(I):
+        return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(I.tolist(), truth.tolist())]))
+
+    rows = []
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIDMap):
+        inner = faiss.downcast_index(inner.index)
+    if isinstance(inner, faiss.IndexIVF):
+        param, values, orig = 'nprobe', [v for v in (1, 2, 4, 8, 16, 32, 64, 128) if v <= inner.nlist], inner.nprobe
+        setter = lambda v: setattr(inner, 'nprobe', v)
+    elif isinstance(inner, faiss.IndexHNSW):
+        param, values, orig = 'efSearch', [16, 32, 64, 128, 256], inner.hnsw.efSearch
+        setter = lambda v: setattr(inner.hnsw, 'efSearch', v)
+    else:
+        param, values, orig, setter = None, [None], None, lambda v: None
+    for v in values:
+        setter(v)
+        I, ms = _timed_search(index, Q, k)
+        rows.append({'param': param, 'value': v, 'recall': round(recall(I), 4), 'ms_per_query': round(ms, 4)})
+    setter(orig)
+    return {'k': k, 'queries': len(Q), 'flat_ms_per_query': round(flat_ms, 4), 'sweep': rows}
+
+
+def _read_previous(index_dir: str):
+    """Existing index, meta rows and vectors, or None if they cannot be reused."""
+    try:
+        with open(os.path.join(index_dir, 'index_info.json'), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('model') != MODEL_NAME:
+            return None
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        X = np.load(os.path.join(index_dir, 'vectors.npy'))
+        index = faiss.read_index(os.path.join(index_dir, 'index.faiss'))
+        with open(os.path.join(index_dir, 'neighbors.json'), 'r', encoding='utf-8') as f:
+            neighbors = json.load(f)
+    except Exception:
+        return None
+    if len(meta) != X.shape[0] or any('faiss_id' not in row or 'content_hash' not in row for row in meta):
+        return None
+    return info, index, meta, X, neighbors
+
+
+def _replace(path: str, write) -> None:
+    """Write via a temp file in the same directory, then rename over `path`.
+
+    A reader that already opened (or memory-mapped) the old file keeps it;
+    new readers never see a partial one.
+    """
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        Path(tmp).unlink(missing_ok=True)
+
+
+def _dump_json(obj, **kw):
+    def write(tmp: str) -> None:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, **kw)
+    return write
+
+
+def _save_npy(X: np.ndarray):
+    def write(tmp: str) -> None:
+        # a file object, since np.save appends .npy to bare paths
+        with open(tmp, 'wb') as f:
+            np.save(f, X)
+    return write
+
+
+def _write(index_dir: str, index, items: List[Dict], X: np.ndarray, neighbors: Dict, info: Dict) -> None:
+    Path(index_dir).mkdir(parents=True, exist_ok=True)
+    _replace(os.path.join(index_dir, 'index.faiss'), lambda tmp: faiss.write_index(index, tmp))
+    _replace(os.path.join(index_dir, 'vectors.npy'), _save_npy(X))
+    _replace(os.path.join(index_dir, 'meta.json'), _dump_json(items, ensure_ascii=False))
+    _replace(os.path.join(index_dir, 'neighbors.json'), _dump_json(neighbors, ensure_ascii=False))
+    _replace(os.path.join(index_dir, 'index_info.json'), _dump_json(info, indent=2))
+
+
+def new_version_dir(root: str) -> str:
+    # mirrors rag_pipeline.new_version_dir / publish_index_version
+    name = time.strftime('v%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+    return os.path.join(root, 'versions', name)
+
+
+def publish_version(root: str, version_dir: str, keep: int = 3) -> None:
+    """Point root/CURRENT at version_dir (atomic rename) and prune old versions."""
+    _replace(os.path.join(root, 'CURRENT'), lambda tmp: Path(tmp).write_text(os.path.basename(version_dir), encoding='utf-8'))
+    versions_dir = os.path.join(root, 'versions')
+    names = sorted(os.listdir(versions_dir))
+    for name in names[:max(0, len(names) - keep)]:
+        if name != os.path.basename(version_dir):
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+
+def _index_kwargs(args) -> Dict:
+    return dict(
+        kind=args.index_type, nlist=args.nlist, hnsw_m=args.hnsw_m, ef_construction=args.ef_construction,
+        pq_m=args.pq_m, pq_bits=args.pq_bits, nprobe=args.nprobe, ef_search=args.ef_search,
+    )
+
+
+def build_full(items: List[Dict], model, args):
     texts = [text_for_embedding(it) for it in items]
     print(f'Encoding {len(texts)} items with {MODEL_NAME}...')
     X = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    X = np.ascontiguousarray(X, dtype='float32')
+    labels = np.arange(len(items), dtype='int64')
+    for it, label in zip(items, labels.tolist()):
+        it['faiss_id'] = label
+        it['content_hash'] = content_hash(it)
+
+    print(f'Building {args.index_type} index...')
+    index = make_index(X, labels=labels, **_index_kwargs(args))
+    neighbors = build_neighbors(index, X, items, SIMILAR_TOP_N, labels=labels)
+    return index, X, neighbors
+
+
+def build_incremental(items: List[Dict], model, args, previous):
+    """Re-encode only new or changed items and patch the existing index in place.
+
+    Unchanged items keep their vector and FAISS id; changed and deleted
+    items are removed with remove_ids. If the index type cannot remove
+    (HNSW) it is rebuilt from the stored vectors, which still avoids
+    re-encoding. Neighbour lists are recomputed for new/changed items and
+    pruned of deleted ones for the rest; each new/changed item is then
+    written back into the lists of its own top-N hits when it outranks
+    their lowest entry (inner-product scores are symmetric).
+    """
+    info, index, meta, X_old, neighbors = previous
+    old = {row['id']: (row, X_old[i]) for i, row in enumerate(meta) if row.get('id')}
+    next_label = max([int(row['faiss_id']) for row in meta] + [-1]) + 1
+
+    vecs: List = [None] * len(items)
+    labels = np.zeros(len(items), dtype='int64')
+    stale: List[int] = []
+    todo: List[int] = []
+    for i, it in enumerate(items):
+        it['content_hash'] = content_hash(it)
+        prev = old.pop(it['id'], None) if it['id'] else None
+        if prev is not None and prev[0]['content_hash'] == it['content_hash']:
+            vecs[i] = prev[1]
+            labels[i] = int(prev[0]['faiss_id'])
+            continue
+        if prev is not None:
+            stale.append(int(prev[0]['faiss_id']))
+        labels[i] = next_label
+        next_label += 1
+        todo.append(i)
+    stale.extend(int(row['faiss_id']) for row, _ in old.values())
+    deleted_ids = set(old)
+
+    print(f'Incremental update: {len(todo)} to encode, {len(stale)} to remove, '
+          f'{len(items) - len(todo)} unchanged.')
+    if todo:
+        enc = model.encode([text_for_embedding(items[i]) for i in todo], convert_to_numpy=True, normalize_embeddings=True)
+        for i, v in zip(todo, np.asarray(enc, dtype='float32')):
+            vecs[i] = v
+    dim = X_old.shape[1] if X_old.size else len(vecs[0])
+    X = np.ascontiguousarray(np.stack(vecs) if vecs else np.zeros((0, dim)), dtype='float32')
+    for it, label in zip(items, labels.tolist()):
+        it['faiss_id'] = label
+
+    try:
+        if stale:
+            index.remove_ids(np.asarray(stale, dtype='int64'))
+        if todo:
+            index.add_with_ids(np.ascontiguousarray(X[todo]), labels[todo])
+    except Exception:
+        print(f'Index type cannot be patched in place; rebuilding {args.index_type} from stored vectors...')
+        index = make_index(X, labels=labels, **_index_kwargs(args))
+
+    changed = {items[i]['id'] for i in todo}
+    dropped = deleted_ids | changed
+    kept = {it['id']: [n for n in neighbors.get(it['id'], []) if n[0] not in dropped]
+            for it in items if it['id'] not in changed}
+    fresh = build_neighbors(index, X, items, SIMILAR_TOP_N, labels=labels, rows=todo)
+    for nid, nbrs in fresh.items():
+        for hit, score in nbrs:
+            table = kept.get(hit)
+            if table is None:
+                continue
+            if len(table) >= SIMILAR_TOP_N:
+                if score <= table[-1][1]:
+                    continue
+                table.pop()
+            pos = next((p for p, (_, s) in enumerate(table) if s < score), len(table))
+            table.insert(pos, [nid, score])
+    kept.update(fresh)
+    return index, X, kept
+
+
+def main():
+    p = argparse.ArgumentParser(description='Encode places and build the FAISS index.')
+    p.add_argument('--index-type', choices=INDEX_TYPES, default=os.getenv('INDEX_TYPE', 'flat'))
+    p.add_argument('--nlist', type=int, default=0, help='IVF lists (default ~4*sqrt(n))')
+    p.add_argument('--nprobe', type=int, default=8, help='IVF lists probed per query (stored default)')
+    p.add_argument('--hnsw-m', type=int, default=32)
+    p.add_argument('--ef-construction', type=int, default=200)
+    p.add_argument('--ef-search', type=int, default=64, help='HNSW search depth (stored default)')
+    p.add_argument('--pq-m', type=int, default=16, help='PQ sub-quantizers (must divide the dimension)')
+    p.add_argument('--pq-bits', type=int, default=8)
+    p.add_argument('--incremental', action='store_true',
+                   help='re-encode only new/changed items and patch the existing index')
+    p.add_argument('--out', help='directory to write the index files to '
+                                 '(default: a new version under the index root, published when done)')
+    p.add_argument('--base', help='index to update with --incremental (default: the active index)')
+    p.add_argument('--report', action='store_true', help='print recall/latency against the flat index')
+    p.add_argument('--report-k', type=int, default=10)
+    args = p.parse_args()
+    publish = not args.out
+    out_dir = os.path.abspath(args.out or new_version_dir(INDEX_DIR))
+
+    items = load_items(os.path.abspath(DATA_JSON))
+    model = SentenceTransformer(MODEL_NAME)
 
-    dim = X.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(X)
+    previous = _read_previous(args.base or active_index_dir(INDEX_DIR)) if args.incremental else None
+    if previous is not None and previous[0].get('index_type') != args.index_type:
+        previous = None
+    if previous is not None:
+        index, X, neighbors = build_incremental(items, model, args, previous)
+    else:
+        if args.incremental:
+            print('No reusable index found; doing a full build.')
+        index, X, neighbors = build_full(items, model, args)
 
-    Path(INDEX_DIR).mkdir(parents=True, exist_ok=True)
-    faiss.write_index(index, os.path.join(INDEX_DIR, 'index.faiss'))
-    np.save(os.path.join(INDEX_DIR, 'vectors.npy'), X)
-    with open(os.path.join(INDEX_DIR, 'meta.json'), 'w', encoding='utf-8') as f:
-        json.dump(items, f, ensure_ascii=False)
-    print('Index built at', INDEX_DIR)
+    info = {'model': MODEL_NAME, 'index_type': args.index_type, 'count': len(items), 'dim': int(X.shape[1])}
+    _write(out_dir, index, items, X, neighbors, info)
+    if out_dir == os.path.abspath(INDEX_DIR):
+        # a build written straight to the root supersedes any published version
+        Path(os.path.join(out_dir, 'CURRENT')).unlink(missing_ok=True)
+    if args.report:
+        labels = np.asarray([it['faiss_id'] for it in items], dtype='int64')
+        report = recall_report(index, X, k=args.report_k, labels=labels)
+        report['index_type'] = args.index_type
+        _replace(os.path.join(out_dir, 'index_report.json'), _dump_json(report, indent=2))
+        print(f"flat: {report['flat_ms_per_query']} ms/query")
+        for row in report['sweep']:
+            label = f"{row['param']}={row['value']}" if row['param'] else args.index_type
+            print(f"{label}: recall@{report['k']}={row['recall']} {row['ms_per_query']} ms/query")
+    if publish:
+        # running servers notice the new CURRENT and swap without restarting
+        publish_version(os.path.abspath(INDEX_DIR), out_dir, keep=int(os.getenv('INDEX_KEEP_VERSIONS', '3')))
+    print('Index built at', out_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+def approx_sizeof(obj: Any) -> int:
+    """Rough deep size in bytes of JSON-like values (dicts, lists, scalars)."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_sizeof(k) + approx_sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(approx_sizeof(v) for v in obj)
+    return size
+
+
+class LRUCache:
+    """Thread-safe bounded LRU cache with an optional TTL and hit/miss counters.
+
+    `sizeof` (value -> bytes) is optional; when given, stats() reports an
+    approximate memory footprint.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data: 'OrderedDict[Hashable, Tuple[Any, Optional[float], int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires, _ = entry
+            if expires is not None and expires < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Insert or refresh `key`; `ttl` overrides the cache default for this entry."""
+        if self.maxsize == 0:
+            return
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl else None
+        nbytes = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, expires, nbytes)
+            self.nbytes += nbytes
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def _drop(self, key: Hashable) -> None:
+        _, _, nbytes = self._data.pop(key)
+        self.nbytes -= nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Live (key, value) pairs, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (v, exp, _) in self._data.items() if exp is None or exp >= now]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        out = {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl_sec': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+        if self.sizeof:
+            out['bytes'] = self.nbytes
+        return out
+
+
+class EmbeddingCache(LRUCache):
+    """LRU of normalized query text -> embedding row, persistable as .npz.
+
+    `tag` (e.g. the model name) is stored with the file; a file written
+    under a different tag is ignored on load.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: Optional[float] = None):
+        super().__init__(maxsize, ttl, sizeof=lambda v: int(v.nbytes))
+
+    def save(self, path: str, tag: str = '') -> int:
+        pairs = self.items()
+        if not pairs:
+            return 0
+        keys = np.array([k for k, _ in pairs])
+        vecs = np.stack([np.asarray(v).reshape(-1) for _, v in pairs]).astype('float32')
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, keys=keys, vectors=vecs, tag=np.array(tag))
+        os.replace(tmp, path)
+        return len(pairs)
+
+    def load(self, path: str, tag: str = '') -> int:
+        if not os.path.exists(path):
+            return 0
+        with np.load(path) as data:
+            if str(data['tag']) != tag:
+                return 0
+            keys, vecs = data['keys'], data['vectors']
+        for key, vec in zip(keys.tolist(), vecs):
+            row = np.ascontiguousarray(vec.reshape(1, -1), dtype='float32')
+            row.setflags(write=False)
+            self.put(key, row)
+        return len(keys)
+
+
+class AnswerCache(LRUCache):
+    """LRU of prompt fingerprint -> generated answer text, persistable as JSON.
+
+    Entries keep their remaining TTL across save/load; expired ones are
+    dropped.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__(maxsize, ttl, sizeof=sys.getsizeof)
+
+    def save(self, path: str) -> int:
+        now_mono, now_wall = time.monotonic(), time.time()
+        with self._lock:
+            rows = [[k, v, None if exp is None else now_wall + (exp - now_mono)]
+                    for k, (v, exp, _) in self._data.items() if exp is None or exp >= now_mono]
+        if not rows:
+            return 0
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return len(rows)
+
+    def load(self, path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+        now = time.time()
+        n = 0
+        for key, value, expires_at in rows:
+            if expires_at is not None and expires_at <= now:
+                continue
+            self.put(key, value, ttl=None if expires_at is None else expires_at - now)
+            n += 1
+        return n
@@ -0,0 +1,152 @@
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = 111.32
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lat: float, lng: float, precision: int = 7) -> str:
+    """Standard base32 geohash; precision 7 is a cell of roughly 150 m."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    out = []
+    bits, ch, even = 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                ch = (ch << 1) | 1
+                lng_lo = mid
+            else:
+                ch <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_GEOHASH_BASE32[ch])
+            bits, ch = 0, 0
+    return ''.join(out)
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def haversine_many_km(lat: float, lng: float, lats, lngs) -> np.ndarray:
+    """Great-circle distance from one point to arrays of points, in km."""
+    lat1 = math.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype='float64'))
+    dlat = lat2 - lat1
+    dlng = np.radians(np.asarray(lngs, dtype='float64')) - math.radians(lng)
+    a = np.sin(dlat * 0.5) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlng * 0.5) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _equirect_xy(lat: float, lng: float, lat0: float):
+    x = math.radians(lng) * math.cos(math.radians(lat0))
+    y = math.radians(lat)
+    return x, y
+
+
+def point_segment_distance_km(a_lat: float, a_lng: float, b_lat: float, b_lng: float,
+                              p_lat: float, p_lng: float) -> float:
+    """Distance from P to segment AB on a local equirectangular projection."""
+    lat0 = (a_lat + b_lat) / 2.0
+    ax, ay = _equirect_xy(a_lat, a_lng, lat0)
+    bx, by = _equirect_xy(b_lat, b_lng, lat0)
+    px, py = _equirect_xy(p_lat, p_lng, lat0)
+    vx, vy = bx - ax, by - ay
+    wx, wy = px - ax, py - ay
+    c1 = vx * wx + vy * wy
+    c2 = vx * vx + vy * vy
+    t = 0.0 if c2 == 0 else max(0.0, min(1.0, c1 / c2))
+    sx, sy = ax + t * vx, ay + t * vy
+    dx, dy = px - sx, py - sy
+    return math.hypot(dx, dy) * EARTH_RADIUS_KM
+
+
+def segment_distances_km(a_lat: float, a_lng: float, b_lat: float, b_lng: float,
+                         lats, lngs) -> np.ndarray:
+    """Vectorized point_segment_distance_km over arrays of points."""
+    return polyline_distances_km([(a_lat, a_lng), (b_lat, b_lng)], lats, lngs)[0]
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> List[Tuple[float, float]]:
+    """Decode a Google encoded polyline into (lat, lng) pairs."""
+    coords: List[Tuple[float, float]] = []
+    factor = 10 ** precision
+    i, lat, lng = 0, 0, 0
+    n = len(encoded)
+    while i < n:
+        deltas = []
+        for _ in range(2):
+            shift, result = 0, 0
+            while True:
+                if i >= n:
+                    raise ValueError('truncated polyline')
+                b = ord(encoded[i]) - 63
+                i += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coords.append((lat / factor, lng / factor))
+    return coords
+
+
+def polyline_distances_km(path: Sequence[Tuple[float, float]], lats: np.ndarray, lngs: np.ndarray,
+                          chunk: int = 1 << 20):
+    """Distance from each point to a polyline and its position along it, in one vectorized pass.
+
+    Returns (dist_km, along_km): the distance to the nearest segment and
+    the distance travelled along the path to the foot of that perpendicular.
+    Uses one equirectangular projection centred on the path.
+    """
+    pts = np.asarray(path, dtype='float64').reshape(-1, 2)
+    lats = np.asarray(lats, dtype='float64')
+    lngs = np.asarray(lngs, dtype='float64')
+    if len(pts) == 1:
+        pts = np.vstack([pts, pts])
+    cos0 = math.cos(math.radians(float(pts[:, 0].mean())))
+    ax = np.radians(pts[:-1, 1]) * cos0
+    ay = np.radians(pts[:-1, 0])
+    vx = np.radians(pts[1:, 1]) * cos0 - ax
+    vy = np.radians(pts[1:, 0]) - ay
+    c2 = vx * vx + vy * vy
+    seg_len = np.sqrt(c2)
+    start = np.concatenate([[0.0], np.cumsum(seg_len)[:-1]])
+    px = np.radians(lngs) * cos0
+    py = np.radians(lats)
+
+    dist = np.empty(len(lats))
+    along = np.empty(len(lats))
+    step = max(1, chunk // max(len(ax), 1))
+    for lo in range(0, len(lats), step):
+        wx = px[lo:lo + step, None] - ax
+        wy = py[lo:lo + step, None] - ay
+        t = np.divide(wx * vx + wy * vy, c2, out=np.zeros_like(wx), where=c2 > 0)
+        np.clip(t, 0.0, 1.0, out=t)
+        d = np.hypot(wx - t * vx, wy - t * vy)
+        best = np.argmin(d, axis=1)
+        rows = np.arange(len(best))
+        dist[lo:lo + step] = d[rows, best]
+        along[lo:lo + step] = start[best] + t[rows, best] * seg_len[best]
+    return dist * EARTH_RADIUS_KM, along * EARTH_RADIUS_KM
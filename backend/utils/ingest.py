@@ -17,7 +17,7 @@ def main():
     subprocess.check_call(['python', converter, '--src', args.src, '--dst', args.dst])
     print('[ingest] Rebuilding FAISS index...')
     try:
-        subprocess.check_call(['python', build])
+        subprocess.check_call(['python', build, '--incremental'])
     except Exception as e:
         print('[ingest] Skipped FAISS build:', e)
     print('[ingest] Done. JSON at', os.path.abspath(args.dst))
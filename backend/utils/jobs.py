@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except (OSError, TypeError, ValueError):
+        return False
+
+
+class JobRegistry:
+    """Run callables on background threads and keep their status for polling.
+
+    Only one job of a given kind runs at a time; submitting while one is
+    queued or running returns the existing job.
+
+    With `state_dir` every status change is also written to
+    state_dir/<job_id>.json, so any worker process sharing that directory
+    can answer get() and sees jobs started by its siblings (a job whose
+    owning process has died is not treated as running).
+    """
+
+    def __init__(self, keep: int = 50, state_dir: Optional[str] = None):
+        self.keep = keep
+        self.state_dir = state_dir
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def _path(self, job_id: str) -> Optional[str]:
+        if not self.state_dir or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        path = self._path(job['id'])
+        if path is None:
+            return
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(job, f, default=str)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _shared_active(self, kind: str) -> Optional[Dict[str, Any]]:
+        """A queued/running job of `kind` owned by another live process."""
+        if not self.state_dir:
+            return None
+        try:
+            names = os.listdir(self.state_dir)
+        except OSError:
+            return None
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            job = self._load(name[:-5])
+            if (job and job.get('kind') == kind and job.get('status') in ('queued', 'running')
+                    and job.get('pid') != os.getpid() and _pid_alive(job.get('pid'))):
+                return job
+        return None
+
+    def submit(self, kind: str, fn: Callable[[Dict[str, Any]], Any]) -> Dict[str, Any]:
+        with self._lock:
+            for job in self._jobs.values():
+                if job['kind'] == kind and job['status'] in ('queued', 'running'):
+                    return dict(job)
+            shared = self._shared_active(kind)
+            if shared is not None:
+                return shared
+            job = {
+                'id': uuid.uuid4().hex,
+                'kind': kind,
+                'status': 'queued',
+                'message': '',
+                'result': None,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'pid': os.getpid(),
+            }
+            self._jobs[job['id']] = job
+            self._prune()
+            self._save(job)
+            snapshot = dict(job)
+        threading.Thread(target=self._run, args=(job, fn), name=f'job-{kind}', daemon=True).start()
+        return snapshot
+
+    def update(self, job: Dict[str, Any], **fields: Any) -> None:
+        """Set fields on a running job (e.g. its message) and publish them."""
+        job.update(fields)
+        self._save(job)
+
+    def _run(self, job: Dict[str, Any], fn: Callable[[Dict[str, Any]], Any]) -> None:
+        self.update(job, status='running', started_at=time.time())
+        try:
+            job['result'] = fn(job)
+            job['status'] = 'done'
+        except Exception as e:
+            job['status'] = 'failed'
+            job['message'] = job['message'] or f'{e.__class__.__name__}: {e}'
+        self.update(job, finished_at=time.time())
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j['status'] in ('done', 'failed')]
+        finished.sort(key=lambda j: j['created_at'])
+        for job in finished[:max(0, len(self._jobs) - self.keep)]:
+            self._jobs.pop(job['id'], None)
+            path = self._path(job['id'])
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job:
+            return dict(job)
+        return self._load(job_id)
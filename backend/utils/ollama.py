@@ -0,0 +1,263 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import requests  # type: ignore
+    from requests.adapters import HTTPAdapter  # type: ignore
+except Exception:
+    requests = None  # type: ignore
+
+
+class CircuitBreaker:
+    """Closed -> open after `failures` consecutive failures; half-open after `cooldown` seconds.
+
+    While open every call is refused. Half-open lets one probe through:
+    success closes the breaker, failure re-opens it for another cooldown.
+    """
+
+    def __init__(self, failures: int = 3, cooldown: float = 30.0):
+        self.failures = max(1, int(failures))
+        self.cooldown = float(cooldown)
+        self.state = 'closed'
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = 'half_open'
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive += 1
+            self._probing = False
+            if self.state == 'half_open' or self.consecutive >= self.failures:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry = self.cooldown - (time.monotonic() - self.opened_at) if self.state == 'open' else 0.0
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive,
+                'trips': self.trips,
+                'retry_in_sec': round(max(0.0, retry), 2),
+            }
+
+
+class LatencyTracker:
+    """Rolling window of call latencies driving an adaptive timeout.
+
+    The timeout is `multiplier` x p95 of the window, clamped to
+    [floor, ceiling]; until `min_samples` are seen it stays at the ceiling.
+    """
+
+    def __init__(self, ceiling: float, floor: float = 1.0, multiplier: float = 1.5,
+                 window: int = 100, min_samples: int = 10):
+        self.ceiling = float(ceiling)
+        self.floor = min(float(floor), self.ceiling)
+        self.multiplier = float(multiplier)
+        self.min_samples = int(min_samples)
+        self._samples: deque = deque(maxlen=int(window))
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(float(seconds))
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def timeout(self) -> float:
+        with self._lock:
+            n = len(self._samples)
+        if n < self.min_samples:
+            return self.ceiling
+        return max(self.floor, min(self.ceiling, self.multiplier * (self.p95() or self.ceiling)))
+
+
+class BreakerOpen(RuntimeError):
+    pass
+
+
+class OllamaClient:
+    """Ollama /api/generate over one pooled HTTP session.
+
+    Keep-alive connections are reused across requests and threads, so a
+    chat turn no longer pays for a new TCP connection. OLLAMA_ENDPOINT,
+    OLLAMA_MODEL, OLLAMA_TIMEOUT_SEC and OLLAMA_POOL_SIZE configure it.
+
+    Calls go through a circuit breaker (OLLAMA_BREAKER_FAILURES,
+    OLLAMA_BREAKER_COOLDOWN_SEC): errors, timeouts and replies slower
+    than OLLAMA_LATENCY_BUDGET_SEC count as failures, and while the
+    breaker is open calls fail immediately so callers fall back at once.
+    The request timeout adapts to observed p95 latency, capped at
+    OLLAMA_TIMEOUT_SEC (OLLAMA_TIMEOUT_MIN_SEC, OLLAMA_TIMEOUT_P95_MULT).
+    """
+
+    def __init__(self, endpoint: Optional[str] = None, model: Optional[str] = None,
+                 timeout: Optional[float] = None, pool_size: Optional[int] = None):
+        self.endpoint = endpoint or os.getenv('OLLAMA_ENDPOINT', 'http://127.0.0.1:11434/api/generate')
+        self.model = model or os.getenv('OLLAMA_MODEL', 'tinyllama')
+        self.timeout = timeout if timeout is not None else float(os.getenv('OLLAMA_TIMEOUT_SEC', '6.0'))
+        size = pool_size if pool_size is not None else int(os.getenv('OLLAMA_POOL_SIZE', '16'))
+        self.latency_budget = float(os.getenv('OLLAMA_LATENCY_BUDGET_SEC', '5.0'))
+        self.breaker = CircuitBreaker(
+            failures=int(os.getenv('OLLAMA_BREAKER_FAILURES', '3')),
+            cooldown=float(os.getenv('OLLAMA_BREAKER_COOLDOWN_SEC', '30')),
+        )
+        self.latency = LatencyTracker(
+            ceiling=self.timeout,
+            floor=float(os.getenv('OLLAMA_TIMEOUT_MIN_SEC', '1.0')),
+            multiplier=float(os.getenv('OLLAMA_TIMEOUT_P95_MULT', '1.5')),
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _payload(self, prompt: str, model: Optional[str], stream: bool, options: Optional[Dict]) -> Dict:
+        body = {'model': model or self.model, 'prompt': prompt, 'stream': stream}
+        if options:
+            body['options'] = options
+        return body
+
+    def _timeout(self, requested: Optional[float]) -> float:
+        # a half-open probe gets the full ceiling so a slower-but-healthy
+        # server can close the breaker and re-seed the latency window
+        adaptive = self.timeout if self.breaker.state == 'half_open' else self.latency.timeout()
+        return min(adaptive, requested) if requested else adaptive
+
+    def _record_timeout(self, exc: Exception, start: float, limit: float) -> None:
+        """Count a timed-out call as a sample of at least `limit`, so the timeout can grow back."""
+        if isinstance(exc, requests.exceptions.Timeout):
+            self.latency.add(max(limit, time.monotonic() - start))
+
+    def generate(self, prompt: str, model: Optional[str] = None, timeout: Optional[float] = None,
+                 options: Optional[Dict] = None) -> Optional[str]:
+        """Full completion text, or None on any error, empty reply or open breaker."""
+        if not self.breaker.allow():
+            return None
+        start = time.monotonic()
+        limit = self._timeout(timeout)
+        try:
+            resp = self.session.post(self.endpoint, json=self._payload(prompt, model, False, options),
+                                     timeout=limit)
+            if resp.status_code != 200:
+                self.breaker.record_failure()
+                return None
+            txt = (resp.json().get('response') or '').strip()
+        except Exception as e:
+            self._record_timeout(e, start, limit)
+            self.breaker.record_failure()
+            return None
+        elapsed = time.monotonic() - start
+        self.latency.add(elapsed)
+        if self.latency_budget > 0 and elapsed > self.latency_budget:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return txt or None
+
+    def stream(self, prompt: str, model: Optional[str] = None, timeout: Optional[float] = None,
+               options: Optional[Dict] = None) -> Iterator[str]:
+        """Yield response fragments as Ollama produces them.
+
+        The (adaptive) timeout applies to connecting and to each gap
+        between fragments, not to the whole generation; time to first
+        fragment feeds the latency window and is held to the latency
+        budget. Errors, and an open breaker (BreakerOpen), propagate to
+        the caller.
+        """
+        if not self.breaker.allow():
+            raise BreakerOpen('ollama circuit open')
+        start = time.monotonic()
+        limit = self._timeout(timeout)
+        first = True
+        try:
+            with self.session.post(self.endpoint, json=self._payload(prompt, model, True, options),
+                                   timeout=limit, stream=True) as resp:
+                resp.raise_for_status()
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise RuntimeError(chunk['error'])
+                    if first:
+                        first = False
+                        ttft = time.monotonic() - start
+                        self.latency.add(ttft)
+                        if self.latency_budget > 0 and ttft > self.latency_budget:
+                            self.breaker.record_failure()
+                        else:
+                            self.breaker.record_success()
+                    if chunk.get('response'):
+                        yield chunk['response']
+                    if chunk.get('done'):
+                        break
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            if first:
+                self._record_timeout(e, start, limit)
+                self.breaker.record_failure()
+            raise
+        if first:
+            # closed without output
+            self.breaker.record_failure()
+
+    def health(self) -> Dict[str, Any]:
+        p95 = self.latency.p95()
+        return {
+            'endpoint': self.endpoint,
+            'model': self.model,
+            'breaker': self.breaker.snapshot(),
+            'timeout_sec': round(self.latency.timeout(), 3),
+            'p95_latency_sec': round(p95, 3) if p95 is not None else None,
+        }
+
+
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> Optional[OllamaClient]:
+    """Process-wide shared client; None when `requests` is not installed."""
+    global _client
+    if requests is None:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
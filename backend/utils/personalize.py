@@ -1,5 +1,14 @@
-from typing import Dict, Any, List
-from collections import defaultdict, Counter
+import atexit
+import copy
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from collections import Counter
+
+from backend.utils.cache import LRUCache
 
 DEFAULT_PREFS = {
     'likes': [],
@@ -11,16 +20,364 @@ DEFAULT_PREFS = {
     'time_preference': None,
 }
 
+# label -> keywords per group; a label counts once per interaction when any
+# of its keywords occurs anywhere in the query + answer text (substring match)
+DEFAULT_VOCAB: Dict[str, Dict[str, List[str]]] = {
+    'likes': {kw: [kw] for kw in ['historical', 'food', 'religious', 'art', 'parks', 'landmark']},
+    'tags': {
+        'quiet': ['quiet', 'calm', 'peaceful', 'serene'],
+        'night view': ['night', 'late', 'evening lights'],
+        'historic': ['historic', 'heritage', 'museum', 'history'],
+        'riverside': ['river', 'ghat', 'waterfront'],
+        'tea': ['tea', 'cha', 'chai', 'stall'],
+        'cafe': ['cafe', 'coffee'],
+        'street-food': ['street food', 'kathi roll', 'phuchka', 'puchka', 'chaat'],
+        'family': ['family', 'kids'],
+    },
+    'intents': {
+        'food': ['food', 'eat', 'tea', 'cafe', 'street food', 'restaurant'],
+        'photography': ['photo', 'photography', 'iconic', 'view'],
+        'history': ['history', 'historic', 'heritage', 'museum'],
+        'quiet': ['quiet', 'calm', 'peaceful'],
+        'explore': ['explore', 'walk', 'stroll', 'discover'],
+    },
+}
+
+
+def load_vocab(path: Optional[str] = None) -> Dict[str, Dict[str, List[str]]]:
+    """DEFAULT_VOCAB overlaid with a JSON or YAML file of the same shape.
+
+    Labels in the file replace the default keyword list for that label;
+    new groups and labels are added.
+    """
+    vocab = copy.deepcopy(DEFAULT_VOCAB)
+    if not path:
+        return vocab
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml  # type: ignore
+            extra = yaml.safe_load(f) or {}
+        else:
+            extra = json.load(f)
+    for group, labels in extra.items():
+        for label, keys in (labels or {}).items():
+            vocab.setdefault(group, {})[label] = [str(k) for k in (keys or [])]
+    return vocab
+
+
+class KeywordMatcher:
+    """All vocabulary keywords found in a text, in one regex pass.
+
+    The keywords are compiled into a single trie-shaped regex inside a
+    lookahead, so every position reports the longest keyword starting
+    there; shorter keywords that are prefixes of it ("cha" in "chai") are
+    added through a precomputed prefix closure. The result is the same
+    as testing each keyword with `in`, but the cost grows with the text,
+    not with the vocabulary size.
+    """
+
+    def __init__(self, vocab: Dict[str, Dict[str, List[str]]]):
+        self.groups = list(vocab)
+        labels_of: Dict[str, set] = {}
+        for group, labels in vocab.items():
+            for label, keys in labels.items():
+                for kw in keys:
+                    kw = kw.lower()
+                    if kw:
+                        labels_of.setdefault(kw, set()).add((group, label))
+        keywords = sorted(labels_of)
+        self._closure: Dict[str, frozenset] = {
+            kw: frozenset().union(*(labels_of[p] for p in keywords if kw.startswith(p)))
+            for kw in keywords
+        }
+        # preserve vocabulary order when reporting labels
+        self._order = {(g, l): i for i, (g, l) in enumerate((g, l) for g in vocab for l in vocab[g])}
+        self._pattern = re.compile('(?=(' + self._trie_pattern(keywords) + '))') if keywords else None
+
+    @staticmethod
+    def _trie_pattern(keywords: List[str]) -> str:
+        trie: Dict[str, Any] = {}
+        for kw in keywords:
+            node = trie
+            for ch in kw:
+                node = node.setdefault(ch, {})
+            node[''] = True
+
+        def emit(node: Dict[str, Any]) -> str:
+            branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+            if not branches:
+                return ''
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            # a keyword ends here: the longer continuations are optional (greedy)
+            return '(?:' + body + ')?' if '' in node else body
+
+        return emit(trie)
+
+    def classify(self, text: str) -> Dict[str, List[str]]:
+        out: Dict[str, List[str]] = {g: [] for g in self.groups}
+        if self._pattern is None:
+            return out
+        found: set = set()
+        for kw in set(self._pattern.findall(str(text).lower())):
+            found |= self._closure[kw]
+        for group, label in sorted(found, key=self._order.__getitem__):
+            out[group].append(label)
+        return out
+
+
+MATCHER = KeywordMatcher(load_vocab(os.getenv('PREFS_VOCAB_PATH')))
+
+PREFS_DB_PATH = os.getenv('PREFS_DB_PATH', os.path.join(os.path.dirname(__file__), '..', 'data', 'prefs.sqlite3'))
+
+
+def default_prefs() -> Dict[str, Any]:
+    # deep copy: a shallow dict() would share the default lists between users
+    return copy.deepcopy(DEFAULT_PREFS)
+
+
+class MemoryPrefsBackend:
+    """Process-local storage; profiles are lost on restart."""
 
-class PreferenceStore:
     def __init__(self):
-        self._store: Dict[str, Dict[str, Any]] = defaultdict(lambda: dict(DEFAULT_PREFS))
+        self._data: Dict[str, str] = {}
+
+    def load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        raw = self._data.get(user_id)
+        return json.loads(raw) if raw is not None else None
+
+    def save_many(self, profiles: Dict[str, Dict[str, Any]]) -> None:
+        for user_id, prefs in profiles.items():
+            self._data[user_id] = json.dumps(prefs)
+
+    def merge_many(self, changes: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Apply changed top-level keys onto the stored profiles; returns the merged profiles."""
+        merged = {}
+        for user_id, fields in changes.items():
+            doc = self.load(user_id) or {}
+            doc.update(fields)
+            merged[user_id] = doc
+        self.save_many(merged)
+        return merged
+
+
+class SQLPrefsBackend:
+    """One JSON document per user in a `user_prefs` table, via any SQLAlchemy engine.
+
+    Used with a local SQLite file or the app's DATABASE_URL engine.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import Column, Float, MetaData, String, Table, Text
+
+        self.engine = engine
+        self.table = Table(
+            'user_prefs', MetaData(),
+            Column('user_id', String(128), primary_key=True),
+            Column('data', Text, nullable=False),
+            Column('updated_at', Float, nullable=False),
+        )
+        self.table.create(engine, checkfirst=True)
+
+    def load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        from sqlalchemy import select
+
+        with self.engine.connect() as conn:
+            raw = conn.execute(select(self.table.c.data).where(self.table.c.user_id == user_id)).scalar()
+        return json.loads(raw) if raw is not None else None
+
+    def save_many(self, profiles: Dict[str, Dict[str, Any]]) -> None:
+        if not profiles:
+            return
+        with self.engine.begin() as conn:
+            self._upsert(conn, profiles)
+
+    def merge_many(self, changes: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Re-read the stored rows and apply only the changed top-level keys, in one transaction.
+
+        Keys this worker did not touch keep whatever another worker wrote
+        meanwhile. Returns the merged profiles.
+        """
+        if not changes:
+            return {}
+        from sqlalchemy import select
+
+        q = select(self.table.c.user_id, self.table.c.data).where(self.table.c.user_id.in_(list(changes)))
+        if self.engine.dialect.name == 'postgresql':
+            q = q.with_for_update()
+        with self.engine.begin() as conn:
+            stored = {uid: json.loads(raw) for uid, raw in conn.execute(q)}
+            merged = {}
+            for uid, fields in changes.items():
+                doc = stored.get(uid) or {}
+                doc.update(fields)
+                merged[uid] = doc
+            self._upsert(conn, merged)
+        return merged
+
+    def _upsert(self, conn, profiles: Dict[str, Dict[str, Any]]) -> None:
+        now = time.time()
+        rows = [{'user_id': uid, 'data': json.dumps(p), 'updated_at': now} for uid, p in profiles.items()]
+        dialect = self.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(self.table)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={'data': stmt.excluded.data, 'updated_at': stmt.excluded.updated_at},
+            ), rows)
+            return
+        for row in rows:
+            res = conn.execute(self.table.update().where(self.table.c.user_id == row['user_id'])
+                               .values(data=row['data'], updated_at=row['updated_at']))
+            if not res.rowcount:
+                conn.execute(self.table.insert().values(**row))
+
+
+def backend_from_env():
+    """PREFS_BACKEND = memory | sqlite | db; defaults to db when DATABASE_URL is set, else sqlite."""
+    from backend.db import enable_db, engine
+
+    kind = os.getenv('PREFS_BACKEND', 'db' if enable_db else 'sqlite').lower()
+    if kind == 'memory':
+        return MemoryPrefsBackend()
+    if kind == 'db' and enable_db:
+        return SQLPrefsBackend(engine)
+    from sqlalchemy import create_engine
+
+    path = os.path.abspath(PREFS_DB_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return SQLPrefsBackend(create_engine(f'sqlite:///{path}'))
+
+
+class PreferenceStore:
+    """User profiles behind a hot in-memory LRU with write-behind persistence.
+
+    Reads hit the LRU (entries expire PREFS_CACHE_TTL_SEC after they were
+    loaded, so other workers' writes are picked up); updates mark the
+    profile dirty and a background flush writes dirty profiles in batches
+    every PREFS_FLUSH_SEC, or sooner once PREFS_FLUSH_BATCH are pending.
+    A flush sends only the top-level keys changed since the profile was
+    loaded and merges them into the stored row, so concurrent workers
+    editing different keys do not overwrite each other.
+    """
+
+    def __init__(self, backend=None, cache_size: Optional[int] = None, cache_ttl: Optional[float] = None,
+                 flush_interval: Optional[float] = None, flush_batch: Optional[int] = None,
+                 max_history: Optional[int] = None, matcher: Optional[KeywordMatcher] = None):
+        self.matcher = matcher or MATCHER
+        self.backend = backend if backend is not None else backend_from_env()
+        self.max_history = max_history if max_history is not None else int(os.getenv('PREFS_MAX_HISTORY', '50'))
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.getenv('PREFS_FLUSH_SEC', '2'))
+        self.flush_batch = flush_batch if flush_batch is not None else int(os.getenv('PREFS_FLUSH_BATCH', '256'))
+        self._cache = LRUCache(
+            cache_size if cache_size is not None else int(os.getenv('PREFS_CACHE_SIZE', '10000')),
+            ttl=cache_ttl if cache_ttl is not None else float(os.getenv('PREFS_CACHE_TTL_SEC', '30')),
+        )
+        # user_id -> (live profile, stored snapshot it diverged from)
+        self._dirty: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._flusher = None
+        self.flushes = 0
+        atexit.register(self.flush)
+
+    def _entry(self, user_id: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """(live profile, snapshot of the stored profile it was loaded from)."""
+        with self._lock:
+            entry = self._dirty.get(user_id) or self._cache.get(user_id)
+            if entry is None:
+                try:
+                    s = self.backend.load(user_id)
+                except Exception:
+                    s = None
+                base = default_prefs()
+                base.update(s or {})
+                entry = (base, copy.deepcopy(base))
+                # cached only on load: refreshing on hits would keep an active
+                # profile from ever expiring and seeing other workers' writes
+                self._cache.put(user_id, entry)
+            return entry
+
+    def _profile(self, user_id: str) -> Dict[str, Any]:
+        return self._entry(user_id)[0]
+
+    def _mark_dirty(self, user_id: str, entry: Tuple[Dict[str, Any], Dict[str, Any]]) -> None:
+        with self._lock:
+            self._dirty[user_id] = entry
+            pending = len(self._dirty)
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._run_flusher, name='prefs-flush', daemon=True)
+                    self._flusher.start()
+        if pending >= self.flush_batch:
+            self._wake.set()
+
+    def _run_flusher(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self) -> int:
+        """Merge pending profile changes into the backend; returns how many were written."""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            pending = dict(self._dirty)
+            snapshots = {uid: copy.deepcopy(s) for uid, (s, _) in pending.items()}
+            self._dirty.clear()
+        changes = {
+            uid: {k: v for k, v in snap.items() if k not in pending[uid][1] or pending[uid][1][k] != v}
+            for uid, snap in snapshots.items()
+        }
+        changes = {uid: fields for uid, fields in changes.items() if fields}
+        try:
+            merged = self.backend.merge_many(changes)
+        except Exception:
+            with self._lock:
+                for uid, entry in pending.items():
+                    self._dirty.setdefault(uid, entry)
+            raise
+        with self._lock:
+            for uid, snap in snapshots.items():
+                if uid in self._dirty:
+                    # edited again since the snapshot: later flushes diff against it
+                    self._dirty[uid] = (self._dirty[uid][0], snap)
+                elif uid in merged:
+                    doc = default_prefs()
+                    doc.update(merged[uid])
+                    self._cache.put(uid, (doc, copy.deepcopy(doc)))
+        self.flushes += 1
+        return len(changes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': type(self.backend).__name__,
+            'cache': self._cache.stats(),
+            'pending_writes': len(self._dirty),
+            'flushes': self.flushes,
+            'max_history': self.max_history,
+        }
 
     def get(self, user_id: str) -> Dict[str, Any]:
-        return self._store[user_id]
+        return self._profile(user_id)
 
     def update_explicit(self, user_id: str, prefs: Dict[str, Any]) -> Dict[str, Any]:
-        s = self._store[user_id]
+        with self._lock:
+            entry = self._entry(user_id)
+            self._apply_explicit(entry[0], prefs)
+            self._mark_dirty(user_id, entry)
+        return entry[0]
+
+    @staticmethod
+    def _apply_explicit(s: Dict[str, Any], prefs: Dict[str, Any]) -> None:
         if 'mood' in prefs:
             s['mood'] = prefs.get('mood')
         if 'interests' in prefs and isinstance(prefs.get('interests'), list):
@@ -31,58 +388,39 @@ class PreferenceStore:
             s['dietary'] = prefs['dietary']
         if 'companion' in prefs:
             s['companion'] = prefs['companion']
-        return s
 
     def update_from_interaction(self, user_id: str, query: str, answer: str) -> None:
-        s = self._store[user_id]
+        with self._lock:
+            entry = self._entry(user_id)
+            self._apply_interaction(entry[0], query, answer)
+            self._mark_dirty(user_id, entry)
+
+    def _apply_interaction(self, s: Dict[str, Any], query: str, answer: str) -> None:
         s.setdefault('last_queries', [])
         s['last_queries'].append(query)
-        text = (str(query) + ' ' + str(answer)).lower()
-        for kw in ['historical', 'food', 'religious', 'art', 'parks', 'landmark']:
-            if kw in text:
-                s.setdefault('likes', [])
-                if kw not in s['likes']:
-                    s['likes'].append(kw)
-        s.setdefault('tag_counts', {})
-        tag_counter = Counter(s['tag_counts'])
-        tag_map = {
-            'quiet': ['quiet', 'calm', 'peaceful', 'serene'],
-            'night view': ['night', 'late', 'evening lights'],
-            'historic': ['historic', 'heritage', 'museum', 'history'],
-            'riverside': ['river', 'ghat', 'waterfront'],
-            'tea': ['tea', 'cha', 'chai', 'stall'],
-            'cafe': ['cafe', 'coffee'],
-            'street-food': ['street food', 'kathi roll', 'phuchka', 'puchka', 'chaat'],
-            'family': ['family', 'kids'],
-        }
-        for tag, keys in tag_map.items():
-            if any(k in text for k in keys):
-                tag_counter[tag] += 1
-        s['tag_counts'] = dict(tag_counter)
-        s.setdefault('intent_counts', {})
-        intent_counter = Counter(s['intent_counts'])
-        intent_map = {
-            'food': ['food', 'eat', 'tea', 'cafe', 'street food', 'restaurant'],
-            'photography': ['photo', 'photography', 'iconic', 'view'],
-            'history': ['history', 'historic', 'heritage', 'museum'],
-            'quiet': ['quiet', 'calm', 'peaceful'],
-            'explore': ['explore', 'walk', 'stroll', 'discover'],
-        }
-        for intent, keys in intent_map.items():
-            if any(k in text for k in keys):
-                intent_counter[intent] += 1
-        s['intent_counts'] = dict(intent_counter)
+        if self.max_history >= 0 and len(s['last_queries']) > self.max_history:
+            del s['last_queries'][:len(s['last_queries']) - self.max_history]
+        hits = self.matcher.classify(str(query) + ' ' + str(answer))
+        likes = s.setdefault('likes', [])
+        for kw in hits['likes']:
+            if kw not in likes:
+                likes.append(kw)
+        for field, group in (('tag_counts', 'tags'), ('intent_counts', 'intents')):
+            counts = s.get(field) or {}
+            for label in hits[group]:
+                counts[label] = counts.get(label, 0) + 1
+            s[field] = counts
 
     def interests_for(self, user_id: str) -> List[str]:
-        s = self._store[user_id]
+        s = self._profile(user_id)
         return [str(x).lower() for x in (s.get('interests') or [])]
 
     def top_tags(self, user_id: str, k: int = 3) -> List[str]:
-        s = self._store[user_id]
+        s = self._profile(user_id)
         counts = Counter(s.get('tag_counts') or {})
         return [t for t, _ in counts.most_common(k)]
 
     def top_intents(self, user_id: str, k: int = 2) -> List[str]:
-        s = self._store[user_id]
+        s = self._profile(user_id)
         counts = Counter(s.get('intent_counts') or {})
         return [t for t, _ in counts.most_common(k)]
@@ -1,12 +1,22 @@
+import atexit
+import hashlib
 import json
 import os
-from typing import List, Dict, Optional
-import os
-try:
-    import requests  # type: ignore
-except Exception:
-    requests = None  # type: ignore
-from math import radians, sin, cos, asin, sqrt
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Dict, Optional
+import numpy as np
+
+from backend.utils.batching import MicroBatcher
+from backend.utils.bm25 import BM25Index
+from backend.utils.cache import AnswerCache, EmbeddingCache, LRUCache, approx_sizeof
+from backend.utils.geo import geohash_encode, haversine_many_km, polyline_distances_km
+from backend.utils.ollama import get_client
+from backend.utils.rwlock import RWLock
+from backend.utils.scoring import TagFeatures
+from backend.utils.spatial import GridIndex
 
 try:
     import faiss  # type: ignore
@@ -16,43 +26,454 @@ except Exception:
     FAISS_AVAILABLE = False
 
 
-def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    r = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    return r * c
+CURRENT_FILE = 'CURRENT'
+
+
+def resolve_index_dir(root: str) -> str:
+    """Active index directory: the version named in root/CURRENT, else root itself."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+        if name and os.path.isdir(os.path.join(root, 'versions', name)):
+            return os.path.join(root, 'versions', name)
+    except OSError:
+        pass
+    return root
+
+
+def new_version_dir(root: str) -> str:
+    name = time.strftime('v%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+    return os.path.join(root, 'versions', name)
+
+
+def publish_index_version(root: str, version_dir: str, keep: int = 3) -> None:
+    """Point root/CURRENT at version_dir (atomic rename) and prune old versions."""
+    tmp = os.path.join(root, CURRENT_FILE + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(version_dir))
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+    versions_dir = os.path.join(root, 'versions')
+    names = sorted(os.listdir(versions_dir))
+    for name in names[:max(0, len(names) - keep)]:
+        if name != os.path.basename(version_dir):
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+
+def _norm_name(name) -> str:
+    return ' '.join(str(name or '').lower().split())
+
+
+def normalize_query(query) -> str:
+    # MiniLM is uncased, so case and spacing do not change the embedding
+    return ' '.join(str(query or '').lower().split())
+
+
+def answer_key(question: str, items: List[Dict], user_pref: Dict, hour, language: str, model: str,
+               hour_bucket: int = 3) -> str:
+    """Canonical hash of everything that shapes an LLM answer.
+
+    The hour is bucketed so nearby hours share an entry; only the
+    preferences that reach the prompt are included.
+    """
+    try:
+        bucket = int(hour) // max(1, hour_bucket)
+    except (TypeError, ValueError):
+        bucket = -1
+    fields = [
+        normalize_query(question),
+        [_hit_key(it) for it in items[:4]],
+        str(user_pref.get('mood') or '').lower(),
+        sorted(str(x).lower() for x in (user_pref.get('interests') or [])),
+        str(user_pref.get('time_preference') or '').lower(),
+        bucket,
+        str(language or 'en').lower(),
+        model,
+    ]
+    return hashlib.sha1(json.dumps(fields, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _partition(rows: List[Dict], key: str, fallback=None) -> Dict[str, np.ndarray]:
+    """Group row positions by the lowercased value of `key`."""
+    groups: Dict[str, List[int]] = {}
+    for pos, row in enumerate(rows):
+        val = row.get(key)
+        if not val and fallback is not None:
+            val = (fallback(row) or {}).get(key)
+        groups.setdefault(str(val or '').lower(), []).append(pos)
+    return {k: np.asarray(v, dtype='int64') for k, v in groups.items()}
+
+
+def _to_float(v) -> float:
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _hit_key(it: Dict) -> str:
+    return str(it.get('id') or '') or _norm_name(it.get('name'))
+
+
+def fuse_rankings(ranked: Dict[str, List[Dict]], cfg: Dict) -> List[Dict]:
+    """Merge ranked hit lists by reciprocal-rank fusion or weighted score fusion.
+
+    Each fused hit keeps its per-retriever score and rank under
+    'score_components'; 'score' becomes the fused score.
+    """
+    fused: Dict[str, Dict] = {}
+    totals: Dict[str, float] = {}
+    for source, hits in ranked.items():
+        weight = float(cfg.get(f'{source}_weight', 1.0))
+        scores = [float(h.get('score') or 0.0) for h in hits]
+        lo, hi = (min(scores), max(scores)) if scores else (0.0, 0.0)
+        for rank, hit in enumerate(hits, start=1):
+            key = _hit_key(hit)
+            if key not in fused:
+                fused[key] = dict(hit)
+                fused[key]['score_components'] = {}
+            comp = fused[key]['score_components']
+            comp[source] = round(float(hit.get('score') or 0.0), 4)
+            comp[f'{source}_rank'] = rank
+            if cfg.get('fusion') == 'weighted':
+                norm = (float(hit.get('score') or 0.0) - lo) / (hi - lo) if hi > lo else 1.0
+                totals[key] = totals.get(key, 0.0) + weight * norm
+            else:
+                totals[key] = totals.get(key, 0.0) + weight / (cfg.get('rrf_k', 60) + rank)
+    out = []
+    for key, hit in fused.items():
+        hit['score'] = round(totals[key], 6)
+        out.append(hit)
+    out.sort(key=lambda h: h['score'], reverse=True)
+    return out
+
+
+def _lexical_text(it: Dict) -> str:
+    return ' '.join([
+        # name counted twice so exact-name queries rank first
+        str(it.get('name', '')),
+        str(it.get('name', '')),
+        str(it.get('category', '')),
+        str(it.get('description', '')),
+        str(it.get('history', '')),
+        str(it.get('personal_tips', '')),
+        ' '.join([str(x) for x in (it.get('sentiment_tags') or [])]),
+    ])
 
 
 class RAGPipeline:
     def __init__(self, data_path: str, index_dir: str):
         self.data_path = data_path
-        self.index_dir = index_dir
+        # index_dir is the root; versioned builds live under root/versions/
+        self.index_root = index_dir
+        # other worker processes publish new versions through root/CURRENT;
+        # its mtime is polled from the query path (0 disables watching)
+        self.watch_interval = float(os.getenv('INDEX_WATCH_INTERVAL_SEC', '2'))
+        self._current_seen = self._current_mtime()
+        self._next_watch = 0.0
+        self._reload_lock = threading.Lock()
+        self.index_dir = resolve_index_dir(index_dir)
+        # queries hold the read side; swapping in a rebuilt corpus takes the write side
+        self._state_lock = RWLock()
         self.items = self._load_data()
         self.index = None
-        self.model: Optional[SentenceTransformer] = None
+        self.model: Optional['SentenceTransformer'] = None
         self.meta: List[Dict] = []
+        self.vectors: Optional[np.ndarray] = None
+        self.neighbors: Dict[str, List] = {}
+        # id / normalized name -> source item, rebuilt whenever items change
+        self._by_id: Dict[str, Dict] = {}
+        self._by_name: Dict[str, Dict] = {}
+        self._meta_pos: Dict[str, int] = {}
+        self._labels: np.ndarray = np.empty(0, dtype='int64')
+        self._pos_of_label: Optional[Dict[int, int]] = None
+        # lowercased city/type -> sorted positions, for filtered search
+        self._meta_city: Dict[str, np.ndarray] = {}
+        self._meta_type: Dict[str, np.ndarray] = {}
+        self._item_city: Dict[str, np.ndarray] = {}
+        self._item_type: Dict[str, np.ndarray] = {}
+        self.bm25: Optional[BM25Index] = None
+        self.grid: Optional[GridIndex] = None
+        self.tag_features: Optional[TagFeatures] = None
+        self.hybrid_config: Dict = {
+            'mode': os.getenv('SEARCH_MODE', 'hybrid'),
+            'fusion': os.getenv('HYBRID_FUSION', 'rrf'),
+            'dense_weight': float(os.getenv('HYBRID_DENSE_WEIGHT', '1.0')),
+            'lexical_weight': float(os.getenv('HYBRID_LEXICAL_WEIGHT', '1.0')),
+            'rrf_k': int(os.getenv('HYBRID_RRF_K', '60')),
+            'dense_pool': float(os.getenv('HYBRID_DENSE_POOL', '2')),
+        }
+        self._executor = ThreadPoolExecutor(max_workers=int(os.getenv('SEARCH_WORKERS', '4')))
+        # normalized query -> embedding; optionally persisted and warmed at startup
+        self.query_cache = EmbeddingCache(
+            maxsize=int(os.getenv('QUERY_CACHE_SIZE', '4096')),
+            ttl=float(os.getenv('QUERY_CACHE_TTL_SEC', '0')),
+        )
+        self.query_cache_path = os.getenv('QUERY_CACHE_PATH')
+        # cache misses from concurrent requests are encoded together; 0 ms disables batching
+        wait_ms = float(os.getenv('ENCODE_MAX_WAIT_MS', '5'))
+        self._encode_batcher = MicroBatcher(
+            self._encode_batch,
+            max_batch=int(os.getenv('ENCODE_MAX_BATCH', '32')),
+            max_wait_ms=wait_ms,
+        ) if wait_ms > 0 else None
+        # full search results keyed on (version, query, k, filters, mode, geohash cell)
+        self.version = 0
+        self.result_cache = LRUCache(
+            maxsize=int(os.getenv('RESULT_CACHE_SIZE', '2048')),
+            ttl=float(os.getenv('RESULT_CACHE_TTL_SEC', '0')),
+            sizeof=approx_sizeof,
+        )
+        self.result_geohash_precision = int(os.getenv('RESULT_CACHE_GEOHASH_PRECISION', '7'))
+        # LLM answers keyed on answer_key(); only real LLM output is cached, never the fallback
+        self.answer_cache = AnswerCache(
+            maxsize=int(os.getenv('ANSWER_CACHE_SIZE', '1024')),
+            ttl=float(os.getenv('ANSWER_CACHE_TTL_SEC', '86400')),
+        )
+        self.answer_cache_path = os.getenv('ANSWER_CACHE_PATH')
+        self.answer_hour_bucket = int(os.getenv('ANSWER_CACHE_HOUR_BUCKET', '3'))
+        if self.answer_cache_path:
+            try:
+                self.answer_cache.load(self.answer_cache_path)
+            except Exception:
+                pass
+            atexit.register(self.save_answer_cache)
+        if self.query_cache_path:
+            try:
+                self.query_cache.load(self.query_cache_path, tag=self._model_name())
+            except Exception:
+                pass
+            atexit.register(self.save_query_cache)
+
+        self._load_index()
+        self._build_lookups()
 
-        if FAISS_AVAILABLE and os.path.isdir(index_dir):
+    def _load_index(self) -> None:
+        self.index = None
+        self.meta = []
+        self.vectors = None
+        self.neighbors = {}
+        self._exact_index = True
+        if FAISS_AVAILABLE and os.path.isdir(self.index_dir):
             try:
-                self.index = faiss.read_index(os.path.join(index_dir, 'index.faiss'))
+                self.index = faiss.read_index(os.path.join(self.index_dir, 'index.faiss'))
+                self._tune_index()
                 # lazy load metadata
-                meta_path = os.path.join(index_dir, 'meta.json')
+                meta_path = os.path.join(self.index_dir, 'meta.json')
                 if os.path.exists(meta_path):
                     with open(meta_path, 'r', encoding='utf-8') as f:
                         self.meta = json.load(f)
+                # item vectors (memory-mapped) and top-N neighbour table for /similar
+                vec_path = os.path.join(self.index_dir, 'vectors.npy')
+                if os.path.exists(vec_path):
+                    vectors = np.load(vec_path, mmap_mode='r')
+                    if vectors.shape[0] == len(self.meta):
+                        self.vectors = vectors
+                nb_path = os.path.join(self.index_dir, 'neighbors.json')
+                if os.path.exists(nb_path):
+                    with open(nb_path, 'r', encoding='utf-8') as f:
+                        self.neighbors = json.load(f)
                 # lazy load model when first needed
             except Exception:
                 self.index = None
 
-    def _get_model(self) -> Optional[SentenceTransformer]:
+    def _build_lookups(self) -> None:
+        by_id: Dict[str, Dict] = {}
+        by_name: Dict[str, Dict] = {}
+        for it in self.items:
+            iid = str(it.get('id') or '')
+            if iid:
+                by_id.setdefault(iid, it)
+            key = _norm_name(it.get('name'))
+            if key:
+                by_name.setdefault(key, it)
+        self._by_id = by_id
+        self._by_name = by_name
+        self._meta_pos = {str(row.get('id')): pos for pos, row in enumerate(self.meta) if row.get('id')}
+        # FAISS ids of the meta rows; identical to row numbers unless the index
+        # was patched incrementally
+        self._labels = np.asarray([row.get('faiss_id', pos) for pos, row in enumerate(self.meta)], dtype='int64')
+        identity = bool(np.array_equal(self._labels, np.arange(len(self.meta))))
+        self._pos_of_label = None if identity else {int(l): p for p, l in enumerate(self._labels.tolist())}
+        self._meta_city = {k: self._labels[v] for k, v in _partition(self.meta, 'city', self._source_item).items()}
+        self._meta_type = {k: self._labels[v] for k, v in _partition(self.meta, 'type', self._source_item).items()}
+        self._item_city = _partition(self.items, 'city')
+        self._item_type = _partition(self.items, 'type')
+        self.bm25 = BM25Index([_lexical_text(it) for it in self.items])
+        # coordinates as contiguous arrays aligned with self.items for the distance kernels
+        self.lats = np.fromiter((_to_float(it.get('lat')) for it in self.items), dtype='float64', count=len(self.items))
+        self.lngs = np.fromiter((_to_float(it.get('lng')) for it in self.items), dtype='float64', count=len(self.items))
+        self.grid = GridIndex(self.lats, self.lngs, cell_deg=float(os.getenv('GRID_CELL_DEG', '0.01')))
+        self.tag_features = TagFeatures(self.items)
+
+    def _load_corpus(self, index_dir: str) -> Dict:
+        """Load items, index and lookups into a detached state dict, off the query path."""
+        fresh = RAGPipeline.__new__(RAGPipeline)
+        fresh.data_path = self.data_path
+        fresh.index_dir = index_dir
+        fresh.items = fresh._load_data()
+        fresh._load_index()
+        fresh._build_lookups()
+        return fresh.__dict__
+
+    def reload(self, index_dir: Optional[str] = None) -> None:
+        """Re-read the places JSON and an index directory, then swap them in atomically.
+
+        Everything is built before the write lock is taken, so in-flight
+        queries finish on the old corpus and later ones see the new one.
+        """
+        state = self._load_corpus(index_dir or resolve_index_dir(self.index_root))
+        with self._state_lock.write():
+            self.__dict__.update(state)
+            # bumping the version invalidates every cached search result
+            self.version += 1
+            self.result_cache.clear()
+
+    def _current_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self.index_root, CURRENT_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+    def check_current(self) -> bool:
+        """Start a background reload if root/CURRENT now names another version.
+
+        Stats CURRENT at most every watch_interval seconds, so it is cheap
+        to call per query; the caller keeps serving the old corpus until
+        the reload swaps in. Returns True when a reload was started.
+        """
+        now = time.monotonic()
+        if self.watch_interval <= 0 or now < self._next_watch:
+            return False
+        self._next_watch = now + self.watch_interval
+        mtime = self._current_mtime()
+        if mtime == self._current_seen:
+            return False
+        target = resolve_index_dir(self.index_root)
+        if os.path.abspath(target) == os.path.abspath(self.index_dir):
+            self._current_seen = mtime
+            return False
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._reload_current, args=(target, mtime), name='index-reload', daemon=True).start()
+        return True
+
+    def _reload_current(self, target: str, mtime: Optional[int]) -> None:
+        try:
+            self.reload(target)
+            self._current_seen = mtime
+        except Exception:
+            # leave _current_seen stale so the next check retries
+            pass
+        finally:
+            self._reload_lock.release()
+
+    def swap_index(self, version_dir: str, keep: int = 3) -> None:
+        """Hot-swap a freshly built versioned index and make it the one loaded on restart."""
+        self.reload(version_dir)
+        publish_index_version(self.index_root, version_dir, keep=keep)
+
+    def _meta_position(self, item: Dict) -> Optional[int]:
+        """Index position of a source item, if the on-disk index has it."""
+        pos = self._meta_pos.get(str(item.get('id') or ''))
+        if pos is None or self._source_item(self.meta[pos]) is not item:
+            return None
+        return pos
+
+    def _label_pos(self, label: int) -> Optional[int]:
+        """Meta row for a FAISS id returned by a search (None for padding / unknown ids)."""
+        if self._pos_of_label is not None:
+            return self._pos_of_label.get(label)
+        return label if 0 <= label < len(self.meta) else None
+
+    def _stored_vector(self, pos: int):
+        if self.vectors is not None:
+            return np.asarray(self.vectors[pos:pos + 1], dtype='float32')
+        try:
+            return self.index.reconstruct(int(self._labels[pos])).reshape(1, -1)
+        except Exception:
+            return None
+
+    def _source_item(self, row: Dict) -> Optional[Dict]:
+        """Find the source item for an index meta row: by id, then by name as a last resort."""
+        name = _norm_name(row.get('name'))
+        iid = str(row.get('id') or '')
+        if iid:
+            src = self._by_id.get(iid)
+            # guard against a stale index whose ids point at different places
+            if src is not None and (not name or _norm_name(src.get('name')) == name):
+                return src
+        return self._by_name.get(name) if name else None
+
+    def _enrich(self, row: Dict) -> Dict:
+        item = dict(row)
+        # Enrich meta with normalized coordinates and other fields from source items
+        src = self._source_item(item)
+        if src:
+            for key in ('lat','lng','city','type','image','history','personal_tips','sentiment_tags'):
+                if key not in item or not item.get(key):
+                    item[key] = src.get(key)
+            # Fill tags/images if missing
+            if not item.get('images'):
+                item['images'] = src.get('images', [])
+            if not item.get('category'):
+                item['category'] = src.get('category', '')
+            if not item.get('description'):
+                item['description'] = src.get('description', '')
+        return item
+
+    @staticmethod
+    def _model_name() -> str:
+        return os.getenv('MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
+
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Embed a query through the LRU cache; returns a read-only (1, d) row."""
+        key = normalize_query(query)
+        vec = self.query_cache.get(key)
+        if vec is None:
+            if self._encode_batcher is not None:
+                vec = self._encode_batcher(key)
+            else:
+                vec = self._encode_batch([key])[0]
+            vec.setflags(write=False)
+            self.query_cache.put(key, vec)
+        return vec
+
+    def _encode_batch(self, texts: List[str]) -> List[np.ndarray]:
+        X = self.model.encode(texts, normalize_embeddings=True, batch_size=len(texts))
+        X = np.asarray(X, dtype='float32')
+        return [np.ascontiguousarray(X[i:i + 1]) for i in range(len(texts))]
+
+    def save_query_cache(self) -> int:
+        if not self.query_cache_path:
+            return 0
+        try:
+            return self.query_cache.save(self.query_cache_path, tag=self._model_name())
+        except Exception:
+            return 0
+
+    def save_answer_cache(self) -> int:
+        if not self.answer_cache_path:
+            return 0
+        try:
+            return self.answer_cache.save(self.answer_cache_path)
+        except Exception:
+            return 0
+
+    def stats(self) -> Dict:
+        return {
+            'version': self.version,
+            'query_embeddings': self.query_cache.stats(),
+            'search_results': self.result_cache.stats(),
+            'llm_answers': self.answer_cache.stats(),
+            'encode_batches': self._encode_batcher.stats() if self._encode_batcher else None,
+        }
+
+    def _get_model(self) -> Optional['SentenceTransformer']:
         if not FAISS_AVAILABLE:
             return None
         if self.model is None:
-            model_name = os.getenv('MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
             try:
-                self.model = SentenceTransformer(model_name)
+                self.model = SentenceTransformer(self._model_name())
             except Exception:
                 self.model = None
         return self.model
@@ -102,6 +523,74 @@ class RAGPipeline:
 
         return items
 
+    @staticmethod
+    def _allowed_positions(by_city: Dict[str, np.ndarray], by_type: Dict[str, np.ndarray],
+                           city: Optional[str], typ: Optional[str]) -> Optional[np.ndarray]:
+        """Positions matching the city/type filters, or None when unfiltered."""
+        allowed = None
+        if city:
+            allowed = by_city.get(city.lower(), np.empty(0, dtype='int64'))
+        if typ:
+            ids = by_type.get(typ.lower(), np.empty(0, dtype='int64'))
+            allowed = ids if allowed is None else np.intersect1d(allowed, ids, assume_unique=True)
+        return allowed
+
+    def _index_search(self, vec, n: int, allowed: Optional[np.ndarray]):
+        """Top-n search restricted to the `allowed` FAISS ids.
+
+        Uses a FAISS IDSelector when the installed faiss supports search
+        parameters; otherwise grows the candidate set until n survivors are
+        found or the index is exhausted.
+        """
+        if allowed is None:
+            return self.index.search(vec, n)
+        n = min(n, len(allowed))
+        if n <= 0:
+            return np.empty((1, 0), dtype='float32'), np.empty((1, 0), dtype='int64')
+        try:
+            scores, idxs = self.index.search(vec, n, params=self._search_params(faiss.IDSelectorBatch(allowed)))
+            # approximate indexes can come back short under a selective filter
+            if self._exact_index or int((idxs[0] >= 0).sum()) >= n:
+                return scores, idxs
+        except Exception:
+            pass
+        ok = set(allowed.tolist())
+        total = self.index.ntotal
+        fetch = min(max(n * 4, 32), total)
+        while True:
+            scores, idxs = self.index.search(vec, fetch)
+            keep = [j for j, i in enumerate(idxs[0].tolist()) if i in ok]
+            if len(keep) >= n or fetch >= total:
+                keep = keep[:n]
+                return scores[:, keep], idxs[:, keep]
+            fetch = min(fetch * 4, total)
+
+    def _inner_index(self):
+        inner = faiss.downcast_index(self.index)
+        if isinstance(inner, faiss.IndexIDMap):
+            inner = faiss.downcast_index(inner.index)
+        return inner
+
+    def _search_params(self, sel):
+        """Search parameters of the right type for the index on disk, carrying a selector."""
+        inner = self._inner_index()
+        if isinstance(inner, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=sel, nprobe=inner.nprobe)
+        if isinstance(inner, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=sel, efSearch=inner.hnsw.efSearch)
+        return faiss.SearchParameters(sel=sel)
+
+    def _tune_index(self) -> None:
+        """Apply query-time knobs (FAISS_NPROBE / FAISS_EF_SEARCH) to whatever index type was built."""
+        inner = self._inner_index()
+        self._exact_index = isinstance(inner, faiss.IndexFlat)
+        nprobe = os.getenv('FAISS_NPROBE')
+        if nprobe and isinstance(inner, faiss.IndexIVF):
+            inner.nprobe = min(int(nprobe), inner.nlist)
+        ef = os.getenv('FAISS_EF_SEARCH')
+        if ef and isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efSearch = int(ef)
+
     def _filter_items(self, items: List[Dict], city: Optional[str], typ: Optional[str]) -> List[Dict]:
         def ok(it: Dict) -> bool:
             if city and str(it.get('city', '')).lower() != city.lower():
@@ -111,71 +600,139 @@ class RAGPipeline:
             return True
         return [it for it in items if ok(it)]
 
+    def _dense_search(self, query: str, n: int, city: Optional[str], typ: Optional[str]) -> List[Dict]:
+        vec = self._encode_query(query)
+        # filter inside the index so rare cities/types still fill k results
+        allowed = self._allowed_positions(self._meta_city, self._meta_type, city, typ)
+        scores, idxs = self._index_search(vec, n, allowed)
+        results = []
+        for label, score in zip(idxs[0].tolist(), scores[0].tolist()):
+            i = self._label_pos(label)
+            if i is None:
+                continue
+            item = self._enrich(self.meta[i])
+            item['score'] = float(score)
+            results.append(item)
+        return self._filter_items(results, city, typ)
+
+    def _lexical_search(self, query: str, n: int, city: Optional[str], typ: Optional[str]) -> List[Dict]:
+        # BM25 over the inverted index built at load
+        q = (query or '').strip()
+        allowed = self._allowed_positions(self._item_city, self._item_type, city, typ)
+        if not q:
+            pos = range(len(self.items)) if allowed is None else allowed.tolist()
+            return [dict(self.items[i]) for i in list(pos)[:n]]
+        ok = None if allowed is None else set(allowed.tolist())
+        results = []
+        for score, i in self.bm25.search(q, n, allowed=ok):
+            it = dict(self.items[i])
+            it['score'] = round(score, 4)
+            results.append(it)
+        return results
+
+    def _hybrid_search(self, query: str, k: int, city: Optional[str], typ: Optional[str]) -> List[Dict]:
+        cfg = self.hybrid_config
+        # the lexical side covers exact-name recall, so the dense pool can stay small
+        n_dense = max(int(k * cfg['dense_pool']), k)
+        lexical = self._executor.submit(self._lexical_search, query, max(k*4, k), city, typ)
+        dense = self._dense_search(query, n_dense, city, typ)
+        return fuse_rankings({'dense': dense, 'lexical': lexical.result()}, cfg)
+
     def search(self, query: str, k: int = 5, city: Optional[str] = None, typ: Optional[str] = None,
-               user_lat: Optional[float] = None, user_lng: Optional[float] = None) -> List[Dict]:
-        # Embedding search if index + model available
-        if self.index is not None and self._get_model() is not None:
-            vec = self.model.encode([query], normalize_embeddings=True)
-            scores, idxs = self.index.search(vec, max(k*4, k))
-            idx_list = idxs[0].tolist()
-            results = []
-            for i, score in zip(idx_list, scores[0].tolist()):
-                if i < 0 or i >= len(self.meta):
-                    continue
-                item = dict(self.meta[i])
-                # Enrich meta with normalized coordinates and other fields from source items
-                try:
-                    src = next((it for it in self.items if str(it.get('name','')).lower() == str(item.get('name','')).lower()), None)
-                    if src:
-                        for key in ('lat','lng','city','type','image','history','personal_tips','sentiment_tags'):
-                            if key not in item or not item.get(key):
-                                item[key] = src.get(key)
-                        # Fill tags/images if missing
-                        if not item.get('images'):
-                            item['images'] = src.get('images', [])
-                        if not item.get('category'):
-                            item['category'] = src.get('category', '')
-                        if not item.get('description'):
-                            item['description'] = src.get('description', '')
-                except Exception:
-                    pass
-                item['score'] = float(score)
-                results.append(item)
-            results = self._filter_items(results, city, typ)
+               user_lat: Optional[float] = None, user_lng: Optional[float] = None,
+               mode: Optional[str] = None) -> List[Dict]:
+        """Retrieve places for a query.
+
+        mode is 'dense', 'lexical' or 'hybrid' (default from SEARCH_MODE).
+        Without an index or embedding model every mode falls back to lexical.
+        """
+        self.check_current()
+        with self._state_lock.read():
+            return self._search(query, k, city, typ, user_lat, user_lng, mode)
+
+    def _search(self, query: str, k: int, city: Optional[str], typ: Optional[str],
+                user_lat, user_lng, mode: Optional[str]) -> List[Dict]:
+        mode = (mode or self.hybrid_config['mode']).lower()
+        has_loc = user_lat is not None and user_lng is not None
+        key = self._result_key(query, k, city, typ, mode, user_lat, user_lng)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            results = [dict(it) for it in cached]
+            if has_loc:
+                # same geohash cell: keep the cached order, refresh exact distances
+                self._annotate_distance(results, user_lat, user_lng)
+            return results
+
+        dense_ok = self.index is not None and self._get_model() is not None
+        if has_loc and not (query or '').strip():
+            # no query: nearest places over the whole filtered pool
+            results = self._nearest(k, city, typ, user_lat, user_lng)
+        elif not dense_ok or mode == 'lexical':
+            results = self._lexical_search(query, max(k*4, k), city, typ)
+        elif mode == 'hybrid' and (query or '').strip():
+            results = self._hybrid_search(query, k, city, typ)
         else:
-            # keyword fallback
-            q = (query or '').lower().strip()
-            pool = self._filter_items(self.items, city, typ)
-            if not q:
-                results = pool[:k]
-            else:
-                scored = []
-                for it in pool:
-                    text = ' '.join([
-                        it.get('name', ''),
-                        it.get('category', ''),
-                        it.get('description', ''),
-                        it.get('history', ''),
-                        it.get('personal_tips', ''),
-                        ' '.join(it.get('sentiment_tags', [])),
-                    ]).lower()
-                    score = sum(1 for token in q.split() if token in text)
-                    if score > 0:
-                        scored.append((score, it))
-                scored.sort(key=lambda x: x[0], reverse=True)
-                results = [it for _, it in scored]
+            results = self._dense_search(query, max(k*4, k), city, typ)
 
         # Distance-aware re-ranking
-        if user_lat is not None and user_lng is not None:
-            for it in results:
-                try:
-                    d = haversine_km(float(it.get('lat', 0) or 0), float(it.get('lng', 0) or 0), user_lat, user_lng)
-                except Exception:
-                    d = 9999.0
-                it['distance_km'] = round(d, 2)
+        if has_loc:
+            self._annotate_distance(results, user_lat, user_lng)
             results.sort(key=lambda it: (it.get('distance_km', 9999.0)))
 
-        return results[:k]
+        results = results[:k]
+        self.result_cache.put(key, [dict(it) for it in results])
+        return results
+
+    def _nearest(self, k: int, city: Optional[str], typ: Optional[str], user_lat, user_lng) -> List[Dict]:
+        pos = self._allowed_positions(self._item_city, self._item_type, city, typ)
+        if pos is None:
+            pos = np.arange(len(self.items))
+        if not len(pos) or k <= 0:
+            return []
+        try:
+            d = haversine_many_km(float(user_lat), float(user_lng), self.lats[pos], self.lngs[pos])
+        except (TypeError, ValueError):
+            return [dict(self.items[i]) for i in pos[:k].tolist()]
+        top = np.argpartition(d, k - 1)[:k] if len(d) > k else np.arange(len(d))
+        return [dict(self.items[i]) for i in pos[top].tolist()]
+
+    @staticmethod
+    def _annotate_distance(results: List[Dict], user_lat, user_lng) -> None:
+        if not results:
+            return
+        lats = np.fromiter((_to_float(it.get('lat')) for it in results), dtype='float64', count=len(results))
+        lngs = np.fromiter((_to_float(it.get('lng')) for it in results), dtype='float64', count=len(results))
+        try:
+            d = haversine_many_km(float(user_lat), float(user_lng), lats, lngs)
+        except (TypeError, ValueError):
+            d = np.full(len(results), 9999.0)
+        for it, dist in zip(results, np.round(d, 2).tolist()):
+            it['distance_km'] = dist
+
+    def _result_key(self, query: str, k: int, city: Optional[str], typ: Optional[str], mode: str,
+                    user_lat, user_lng) -> tuple:
+        cell = ''
+        if user_lat is not None and user_lng is not None:
+            try:
+                cell = geohash_encode(float(user_lat), float(user_lng), self.result_geohash_precision)
+            except Exception:
+                cell = 'invalid'
+        return (self.version, normalize_query(query), int(k), (city or '').lower(), (typ or '').lower(), mode, cell)
+
+    def near_route(self, path: List[tuple], threshold_km: float) -> List[tuple]:
+        """(distance_km, along_km, item) for items within threshold_km of a polyline.
+
+        Candidates come from the spatial grid cells along the path; their
+        distances to every leg are computed in one vectorized pass.
+        """
+        self.check_current()
+        with self._state_lock.read():
+            cand = self.grid.query_path(path, threshold_km)
+            if not cand:
+                return []
+            dist, along = polyline_distances_km(path, self.lats[cand], self.lngs[cand])
+            return [(float(d), float(a), self.items[i])
+                    for i, d, a in zip(cand, dist.tolist(), along.tolist()) if d <= threshold_km]
 
     def generate_answer(self, question: str, context_items: List[Dict]) -> str:
         if not context_items:
@@ -223,11 +780,7 @@ class RAGPipeline:
             
         return "\n".join(lines)
 
-    def _ollama_answer(self, user_msg: str, items: List[Dict], user_pref: Dict, hour: Optional[int], language: str = 'en') -> Optional[str]:
-        if requests is None:
-            return None
-        model = os.getenv('OLLAMA_MODEL', 'tinyllama')
-        endpoint = os.getenv('OLLAMA_ENDPOINT', 'http://127.0.0.1:11434/api/generate')
+    def _ollama_prompt(self, user_msg: str, items: List[Dict], user_pref: Dict, hour: Optional[int], language: str = 'en') -> str:
         prefs_text = (
             f"mood={user_pref.get('mood')}, "
             f"interests={user_pref.get('interests')}, "
@@ -241,26 +794,20 @@ class RAGPipeline:
         )
         if language != 'en':
             sys += f" Answer in {language}."
-        prompt = (
+        return (
             f"System: {sys}\n"
             f"User: {user_msg}\n"
             f"Preferences: {prefs_text}, hour={hour}\n"
             f"Context candidates:\n{self._context_lines(items)}\n"
             "Assistant:"
         )
-        try:
-            resp = requests.post(
-                endpoint,
-                json={'model': model, 'prompt': prompt, 'stream': False},
-                timeout=float(os.getenv('OLLAMA_TIMEOUT_SEC', '6.0')), # Increased timeout slightly
-            )
-            if resp.status_code == 200:
-                data = resp.json()
-                txt = (data.get('response') or '').strip()
-                return self._short(txt, 500) if txt else None
-        except Exception:
+
+    def _ollama_answer(self, user_msg: str, items: List[Dict], user_pref: Dict, hour: Optional[int], language: str = 'en') -> Optional[str]:
+        client = get_client()
+        if client is None:
             return None
-        return None
+        txt = client.generate(self._ollama_prompt(user_msg, items, user_pref, hour, language))
+        return self._short(txt, 500) if txt else None
 
     def _fallback_answer(self, user_msg: str, items: List[Dict], user_pref: Dict, hour: Optional[int], language: str = 'en') -> str:
         if not items:
@@ -286,42 +833,112 @@ class RAGPipeline:
             base += f" You could also check out {items[1].get('name')} nearby."
         return self._short(base, 450)
 
+    def _answer_key(self, question: str, items: List[Dict], user_pref: Dict, hour, language: str) -> Optional[str]:
+        client = get_client()
+        if client is None:
+            return None
+        return answer_key(question, items, user_pref, hour, language, client.model, self.answer_hour_bucket)
+
     def generate_conversational_answer(self, question: str, context_items: List[Dict], user_pref: Dict, hour: Optional[int] = None, language: str = 'en') -> str:
-        # Try local Ollama; fallback to rule-based
+        # Try local Ollama (cached); fallback to rule-based
+        key = self._answer_key(question, context_items, user_pref, hour, language)
+        txt = self.answer_cache.get(key) if key else None
+        if txt:
+            return txt
         txt = self._ollama_answer(question, context_items, user_pref, hour, language)
         if txt:
+            self.answer_cache.put(key, txt)
             return txt
         return self._fallback_answer(question, context_items, user_pref, hour, language)
 
+    def stream_conversational_answer(self, question: str, context_items: List[Dict], user_pref: Dict,
+                                     hour: Optional[int] = None, language: str = 'en',
+                                     max_chars: int = 500) -> Iterator[str]:
+        """Like generate_conversational_answer, but yields text fragments as the LLM produces them.
+
+        If Ollama fails before producing anything, the rule-based answer
+        is yielded as a single fragment.
+        """
+        key = self._answer_key(question, context_items, user_pref, hour, language)
+        cached = self.answer_cache.get(key) if key else None
+        if cached:
+            yield cached
+            return
+        client = get_client()
+        sent = 0
+        parts: List[str] = []
+        if client is not None:
+            try:
+                for frag in client.stream(self._ollama_prompt(question, context_items, user_pref, hour, language)):
+                    frag = frag[:max_chars - sent]
+                    sent += len(frag)
+                    parts.append(frag)
+                    yield frag
+                    if sent >= max_chars:
+                        break
+                else:
+                    # only a complete generation is worth replaying
+                    txt = ''.join(parts).strip()
+                    if txt:
+                        self.answer_cache.put(key, txt)
+            except Exception:
+                pass
+        if not sent:
+            yield self._fallback_answer(question, context_items, user_pref, hour, language)
+
     # --- Similar items ---
     def similar(self, item_id: str, k: int = 8) -> List[Dict]:
         """Return items similar to the given item id using FAISS if available, otherwise keyword overlap."""
-        base = next((it for it in self.items if str(it.get('id')) == str(item_id)), None)
+        self.check_current()
+        with self._state_lock.read():
+            return self._similar(item_id, k)
+
+    def _similar(self, item_id: str, k: int) -> List[Dict]:
+        base = self._by_id.get(str(item_id))
         if not base:
             return []
-        # Prefer FAISS + model when possible by embedding the base item's combined text
-        if self._get_model() is not None and self.index is not None:
-            text = ' '.join([
-                str(base.get('name','')),
-                str(base.get('category','')),
-                str(base.get('description','')),
-                str(base.get('history','')),
-                str(base.get('personal_tips','')),
-                ' '.join([str(x) for x in (base.get('sentiment_tags') or [])]),
-            ])
-            vec = self.model.encode([text], normalize_embeddings=True)
-            scores, idxs = self.index.search(vec, max(k*3, k))
-            out: List[Dict] = []
-            for i, score in zip(idxs[0].tolist(), scores[0].tolist()):
-                if i < 0 or i >= len(self.meta):
-                    continue
-                cand = dict(self.meta[i])
-                if str(cand.get('id')) == str(item_id):
-                    continue
-                cand['score'] = float(score)
-                out.append(cand)
-            out.sort(key=lambda x: x.get('score', 0), reverse=True)
-            return out[:k]
+        if self.index is not None:
+            # Precomputed neighbour table from build_index.py: a plain lookup
+            pos = self._meta_position(base)
+            table = self.neighbors.get(str(self.meta[pos].get('id'))) if pos is not None else None
+            if table and len(table) >= min(k, len(self.meta) - 1):
+                out: List[Dict] = []
+                for nid, score in table:
+                    j = self._meta_pos.get(str(nid))
+                    if j is None:
+                        continue
+                    cand = dict(self.meta[j])
+                    cand['score'] = float(score)
+                    out.append(cand)
+                    if len(out) >= k:
+                        break
+                return out
+            # Otherwise search with the stored vector; only encode as a last resort
+            vec = self._stored_vector(pos) if pos is not None else None
+            if vec is None and self._get_model() is not None:
+                text = ' '.join([
+                    str(base.get('name','')),
+                    str(base.get('category','')),
+                    str(base.get('description','')),
+                    str(base.get('history','')),
+                    str(base.get('personal_tips','')),
+                    ' '.join([str(x) for x in (base.get('sentiment_tags') or [])]),
+                ])
+                vec = self.model.encode([text], normalize_embeddings=True)
+            if vec is not None:
+                scores, idxs = self.index.search(vec, max(k*3, k))
+                out = []
+                for label, score in zip(idxs[0].tolist(), scores[0].tolist()):
+                    i = self._label_pos(label)
+                    if i is None or i == pos:
+                        continue
+                    cand = dict(self.meta[i])
+                    if str(cand.get('id')) == str(item_id):
+                        continue
+                    cand['score'] = float(score)
+                    out.append(cand)
+                out.sort(key=lambda x: x.get('score', 0), reverse=True)
+                return out[:k]
         # Fallback: simple tag/name overlap
         btags = set([str(x).lower() for x in (base.get('sentiment_tags') or [])])
         scored: List[Dict] = []
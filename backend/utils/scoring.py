@@ -0,0 +1,165 @@
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _any_tag(*names):
+    return lambda tags, joined: any(n in tags for n in names)
+
+
+def _any_text(*names):
+    return lambda tags, joined: any(n in joined for n in names)
+
+
+# Per-item boolean features behind the personalization/context/intent rules.
+# Exact-tag checks test membership; text checks are substring tests on the
+# space-joined tag list, as the original scalar rules did.
+FEATURES: List[Tuple[str, object]] = [
+    ('family', _any_tag('family', 'kids', 'educational')),
+    ('social', _any_tag('romantic', 'nightlife', 'cafe')),
+    ('non_veg', _any_text('non-veg')),
+    ('street_food', _any_text('street-food')),
+    ('rain_ok', _any_tag('indoor', 'cafe', 'museum')),
+    ('late', lambda tags, joined: 'open_late' in tags or 'tea stall' in joined),
+    ('heat_ok', _any_tag('waterfront', 'shade', 'indoor')),
+    ('intent_food', _any_text('street-food', 'cafe', 'tea', 'restaurant')),
+    ('intent_photography', _any_tag('iconic', 'heritage', 'river-view', 'architecture')),
+    ('intent_history', _any_tag('heritage', 'historical', 'museum')),
+    ('intent_quiet', _any_tag('peaceful', 'quiet', 'park', 'open-space')),
+    ('crowded', _any_tag('busy', 'crowd', 'nightlife')),
+]
+FEATURE_INDEX: Dict[str, int] = {name: i for i, (name, _) in enumerate(FEATURES)}
+
+
+def _tags(it: Dict) -> List[str]:
+    return [str(x).lower() for x in (it.get('tags') or [])]
+
+
+def _feature_row(tags: List[str]) -> List[bool]:
+    joined = ' '.join(tags)
+    return [fn(tags, joined) for _, fn in FEATURES]
+
+
+class TagFeatures:
+    """Feature matrix over items, precomputed once per corpus load.
+
+    Rows follow `items`; items passed later are matched by id, and any
+    unknown item (e.g. from an older index) is featurized on the fly.
+    Substring columns for free-form terms (user interests) are built on
+    first use and cached.
+    """
+
+    def __init__(self, items: Sequence[Dict], max_terms: int = 1024):
+        tag_lists = [_tags(it) for it in items]
+        self._joined = [' '.join(t) for t in tag_lists]
+        self.matrix = np.array([_feature_row(t) for t in tag_lists], dtype='float32').reshape(len(items), len(FEATURES))
+        self._row_of: Dict[str, int] = {}
+        for row, it in enumerate(items):
+            iid = str(it.get('id') or '')
+            if iid:
+                self._row_of.setdefault(iid, row)
+        self.max_terms = max_terms
+        self._term_cols: Dict[str, np.ndarray] = {}
+
+    def _rows(self, items: Sequence[Dict]) -> np.ndarray:
+        return np.fromiter((self._row_of.get(str(it.get('id') or ''), -1) for it in items),
+                           dtype='int64', count=len(items))
+
+    def features(self, items: Sequence[Dict]) -> np.ndarray:
+        rows = self._rows(items)
+        out = self.matrix[np.maximum(rows, 0)] if len(self.matrix) else np.zeros((len(items), len(FEATURES)), 'float32')
+        for j in np.flatnonzero(rows < 0).tolist():
+            out[j] = _feature_row(_tags(items[j]))
+        return out
+
+    def _term_col(self, term: str) -> np.ndarray:
+        col = self._term_cols.get(term)
+        if col is None:
+            col = np.fromiter((term in j for j in self._joined), dtype='float32', count=len(self._joined))
+            if len(self._term_cols) >= self.max_terms:
+                self._term_cols.clear()
+            self._term_cols[term] = col
+        return col
+
+    def term_hits(self, items: Sequence[Dict], terms: Sequence[str]) -> np.ndarray:
+        """Number of `terms` that occur as substrings of each item's joined tags."""
+        if not terms or not items:
+            return np.zeros(len(items), dtype='float32')
+        rows = self._rows(items)
+        known = rows >= 0
+        out = np.zeros(len(items), dtype='float32')
+        if known.any():
+            cols = np.stack([self._term_col(t) for t in terms], axis=1)
+            out[known] = cols[rows[known]].sum(axis=1)
+        for j in np.flatnonzero(~known).tolist():
+            joined = ' '.join(_tags(items[j]))
+            out[j] = sum(1.0 for t in terms if t in joined)
+        return out
+
+
+def _vec(weights: Dict[str, float]) -> np.ndarray:
+    w = np.zeros(len(FEATURES), dtype='float32')
+    for name, val in weights.items():
+        w[FEATURE_INDEX[name]] += val
+    return w
+
+
+def personalization_weights(user_pref: Dict) -> Tuple[np.ndarray, float, List[str]]:
+    """(feature weights, constant offset, interest terms) for a user's preferences."""
+    offset = 0.0
+    if str(user_pref.get('time_preference') or '').lower():
+        offset += 0.2
+    if str(user_pref.get('mood') or '').lower():
+        offset += 0.2
+    weights: Dict[str, float] = {}
+    comp = str((user_pref.get('companion') or '')).lower()
+    if comp in ('family', 'kids'):
+        weights['family'] = 0.5
+    if comp in ('couple', 'friends'):
+        weights['social'] = 0.4
+    dietary = user_pref.get('dietary') or {}
+    if bool(dietary.get('veg_only')):
+        weights['non_veg'] = -0.6
+    if bool(dietary.get('street_food_ok')):
+        weights['street_food'] = 0.3
+    interests = [str(x).lower() for x in (user_pref.get('interests') or [])]
+    return _vec(weights), offset, interests
+
+
+def context_weights(weather: Optional[str], tm, temp_c) -> np.ndarray:
+    weights: Dict[str, float] = {}
+    if 'rain' in (weather or '').lower():
+        weights['rain_ok'] = 0.7
+    if tm:
+        hour = tm if isinstance(tm, int) else time.localtime().tm_hour
+        if hour >= 20 or hour < 6:
+            weights['late'] = 0.5
+    try:
+        t = float(temp_c) if temp_c is not None else None
+    except Exception:
+        t = None
+    if t is not None and t > 35:
+        weights['heat_ok'] = 0.5
+    return _vec(weights)
+
+
+def intent_weights(intent: Optional[str]) -> np.ndarray:
+    name = 'intent_' + (intent or '').lower()
+    return _vec({name: 0.6} if name in FEATURE_INDEX else {})
+
+
+def score_pool(features: TagFeatures, items: Sequence[Dict], user_pref: Dict,
+               weather: Optional[str] = None, tm=None, temp_c=None,
+               intent: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """Personalization, context and intent scores (plus the crowd flag) for a candidate pool."""
+    X = features.features(items)
+    p_w, p_off, interests = personalization_weights(user_pref)
+    W = np.stack([p_w, context_weights(weather, tm, temp_c), intent_weights(intent)], axis=1)
+    S = X @ W
+    return {
+        'personal': S[:, 0] + p_off + features.term_hits(items, interests),
+        'context': S[:, 1],
+        'intent': S[:, 2],
+        'crowded': X[:, FEATURE_INDEX['crowded']] > 0,
+    }
@@ -0,0 +1,75 @@
+import math
+from typing import Dict, List, Sequence, Tuple
+
+from backend.utils.geo import KM_PER_DEG_LAT, point_segment_distance_km
+
+
+class GridIndex:
+    """Uniform lat/lng grid bucketing item positions.
+
+    Items at (0, 0) are treated as missing coordinates and left out. The
+    default cell of 0.01 deg is about 1.1 km, so a corridor query around a
+    city route touches a few cells instead of every item.
+    """
+
+    def __init__(self, lats: Sequence[float], lngs: Sequence[float], cell_deg: float = 0.01):
+        self.cell = float(cell_deg)
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for pos, (lat, lng) in enumerate(zip(lats, lngs)):
+            if lat == 0 and lng == 0:
+                continue
+            self._cells.setdefault(self._key(lat, lng), []).append(pos)
+
+    def _key(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell)), int(math.floor(lng / self.cell))
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._cells.values())
+
+    def _cells_in(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+        r0, c0 = self._key(min_lat, min_lng)
+        r1, c1 = self._key(max_lat, max_lng)
+        if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self._cells):
+            # huge box over a sparse grid: cheaper to walk the occupied cells
+            return [key for key in self._cells if r0 <= key[0] <= r1 and c0 <= key[1] <= c1]
+        return [(r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1) if (r, c) in self._cells]
+
+    def query_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> List[int]:
+        out: List[int] = []
+        for key in self._cells_in(min_lat, min_lng, max_lat, max_lng):
+            out.extend(self._cells[key])
+        return out
+
+    def query_segment(self, a_lat: float, a_lng: float, b_lat: float, b_lng: float, buffer_km: float) -> List[int]:
+        """Positions in cells that come within buffer_km of segment AB."""
+        return self.query_path([(a_lat, a_lng), (b_lat, b_lng)], buffer_km)
+
+    def _segment_cells(self, a_lat: float, a_lng: float, b_lat: float, b_lng: float, buffer_km: float):
+        """Occupied cells of the segment's buffered bounding box.
+
+        Cells are kept only if their centre is within buffer_km plus half a
+        cell diagonal of the segment, so long diagonal legs do not pull in
+        the whole box.
+        """
+        mid_lat = (a_lat + b_lat) / 2.0
+        dlat = buffer_km / KM_PER_DEG_LAT
+        dlng = buffer_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(mid_lat)), 1e-6))
+        half_diag_km = 0.5 * math.hypot(self.cell * KM_PER_DEG_LAT,
+                                        self.cell * KM_PER_DEG_LAT * math.cos(math.radians(mid_lat)))
+        for r, c in self._cells_in(min(a_lat, b_lat) - dlat, min(a_lng, b_lng) - dlng,
+                                   max(a_lat, b_lat) + dlat, max(a_lng, b_lng) + dlng):
+            clat, clng = (r + 0.5) * self.cell, (c + 0.5) * self.cell
+            if point_segment_distance_km(a_lat, a_lng, b_lat, b_lng, clat, clng) <= buffer_km + half_diag_km:
+                yield r, c
+
+    def query_path(self, path: Sequence[Tuple[float, float]], buffer_km: float) -> List[int]:
+        """Positions in cells that come within buffer_km of any leg of a polyline."""
+        if len(path) == 1:
+            path = [path[0], path[0]]
+        cells = set()
+        for (a_lat, a_lng), (b_lat, b_lng) in zip(path[:-1], path[1:]):
+            cells.update(self._segment_cells(a_lat, a_lng, b_lat, b_lng, buffer_km))
+        out: List[int] = []
+        for key in cells:
+            out.extend(self._cells[key])
+        return out